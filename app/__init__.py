@@ -6,6 +6,7 @@ from flask import Flask
 from authlib.integrations.flask_client import OAuth
 from flask_wtf.csrf import CSRFProtect
 from .config import config_by_name
+from .services.routing import load_routing_table
 
 # Inicializa extensões (objetos vazios que serão ligados ao app depois)
 oauth = OAuth()
@@ -44,10 +45,21 @@ def create_app(config_name='default'):
         app.logger.critical(f"FALHA CRÍTICA ao inicializar Firebase: {e}")
         app.db = None
 
+    # Tabela de roteamento turma -> coleção/painel (falha aqui derruba o boot de propósito)
+    app.routing_table = load_routing_table(app.config.get('ROUTING_TABLE_FILE'))
+
     # 3. Inicialização das Extensões
     oauth.init_app(app)
     csrf.init_app(app)
 
+    # Cache unificado (backend conforme CACHE_TYPE)
+    from .services import cache
+    cache.init_app(app)
+
+    # Contadores de I/O por requisição e profiling sob demanda
+    from .services import profiling
+    profiling.init_app(app)
+
     # Configuração do Google OAuth
     oauth.register(
         name='google',
@@ -63,5 +75,10 @@ def create_app(config_name='default'):
     app.register_blueprint(auth.bp)
     app.register_blueprint(main.bp)
     app.register_blueprint(api.bp)
+    main.register_panel_routes(app)
+
+    # 5. Comandos CLI (flask exportar-chamadas ...)
+    from .services import export
+    export.register_cli(app)
 
     return app
\ No newline at end of file
@@ -26,6 +26,15 @@ class Config:
     if SOPHIA_API_HOSTNAME and SOPHIA_TENANT:
         SOPHIA_BASE_URL = f"https://{SOPHIA_API_HOSTNAME}/SophiAWebApi/{SOPHIA_TENANT}"
 
+    # Resiliência do cliente SophiA (Circuit Breaker + Limite Adaptativo)
+    # Após N falhas seguidas o circuito abre e as buscas passam a usar o último dado bom.
+    SOPHIA_CB_FAILURE_THRESHOLD = int(os.getenv('SOPHIA_CB_FAILURE_THRESHOLD', 5))
+    SOPHIA_CB_RESET_SECONDS = int(os.getenv('SOPHIA_CB_RESET_SECONDS', 30))
+    SOPHIA_MAX_CONCURRENCY = int(os.getenv('SOPHIA_MAX_CONCURRENCY', 16))
+    # Latência média (s) acima da qual o limite de concorrência cai. Vazio = metade do timeout da busca.
+    SOPHIA_LATENCY_TARGET = float(os.getenv('SOPHIA_LATENCY_TARGET')) if os.getenv('SOPHIA_LATENCY_TARGET') else None
+    SOPHIA_ACQUIRE_TIMEOUT = float(os.getenv('SOPHIA_ACQUIRE_TIMEOUT', 2.0))
+
     # --- REGRAS DE NEGÓCIO (Externalizadas) ---
     # Define o prefixo de turmas que devem ser IGNORADAS na busca (ex: Ensino Médio)
     # Se a escola mudar para "MEDIO", basta alterar aqui.
@@ -35,6 +44,38 @@ class Config:
     # Captura 4 dígitos consecutivos
     REGEX_CLASS_YEAR = r'(\d{4})'
 
+    # Fuso horário da escola: dia/hora dos relatórios de analytics (o App Engine roda em UTC)
+    TIMEZONE = os.getenv('TIMEZONE', 'America/Sao_Paulo')
+
+    # Tabela de roteamento (JSON) turma -> coleção/painel, por unidade e segmento.
+    # Sem arquivo, usa a regra padrão (chamados_ei / chamados_1ano / chamados_fund).
+    # Ver routing.json.example.
+    ROUTING_TABLE_FILE = os.getenv('ROUTING_TABLE_FILE')
+
+    # --- CACHE UNIFICADO (app/services/cache.py) ---
+    # 'memory' (por processo), 'filesystem' (CACHE_DIR) ou 'redis' (CACHE_REDIS_URL, requer o pacote redis)
+    CACHE_TYPE = os.getenv('CACHE_TYPE', 'memory')
+    CACHE_DIR = os.getenv('CACHE_DIR', '/tmp/chamada-visual-cache')
+    CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+    CACHE_THRESHOLD = int(os.getenv('CACHE_THRESHOLD', 500))
+    CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX', 'chamada-visual:')
+
+    # Coleções extras incluídas na exportação de histórico (ex: arquivos), separadas por vírgula
+    EXPORT_EXTRA_COLLECTIONS = os.getenv('EXPORT_EXTRA_COLLECTIONS', '')
+
+    # Segundos que o snapshot inicial de cada painel fica em cache (compartilhado entre TVs)
+    PANEL_SNAPSHOT_TTL = int(os.getenv('PANEL_SNAPSHOT_TTL', 5))
+
+    # --- PROFILING SOB DEMANDA ---
+    # E-mails (separados por vírgula) autorizados a pedir profiling com o header 'X-Profile: 1'
+    PROFILING_OPERATORS = os.getenv('PROFILING_OPERATORS', '')
+    # Fração de requisições amostradas automaticamente (0.0 = desligado)
+    PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+    # Onde salvar os arquivos .prof (no App Engine só /tmp é gravável)
+    PROFILING_DIR = os.getenv('PROFILING_DIR', '/tmp/chamada-visual-profiles')
+    # Quantos arquivos .prof manter (os mais antigos são apagados)
+    PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', 20))
+
 class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = False
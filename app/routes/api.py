@@ -1,14 +1,17 @@
 import logging
 import concurrent.futures
 import base64
-from flask import Blueprint, request, jsonify, session, Response
-from app.services import sophia, firestore
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, session, Response, g, stream_with_context, current_app
+from app.services import sophia, firestore, profiling, cache, export
+from app.routes.wire import api_response, compress_response
 from functools import wraps
 
 # Configura Logger
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('api', __name__, url_prefix='/api')
+bp.after_request(compress_response)
 
 def login_required(f):
     @wraps(f)
@@ -18,6 +21,27 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+@bp.after_request
+def sinalizar_dados_desatualizados(response):
+    """Avisa o terminal quando a resposta veio do cache por indisponibilidade do SophiA."""
+    if g.get('sophia_stale'):
+        response.headers['X-Sophia-Stale'] = '1'
+    return response
+
+def in_worker(fn):
+    """
+    Prepara `fn` para rodar numa thread do ThreadPoolExecutor: empurra o contexto
+    da aplicação (db, tabela de roteamento, config) e propaga os contadores de I/O.
+    """
+    app = current_app._get_current_object()
+    bound = profiling.bind_to_request(fn)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return bound(*args, **kwargs)
+    return wrapper
+
 def enrich_with_call_count(aluno):
     """Injeta contagem atual no objeto aluno."""
     try:
@@ -43,9 +67,9 @@ def buscar_aluno():
         # Enriquece com contagem em paralelo
         if alunos:
             with concurrent.futures.ThreadPoolExecutor() as executor:
-                list(executor.map(enrich_with_call_count, alunos))
+                list(executor.map(in_worker(enrich_with_call_count), alunos))
 
-        return jsonify(alunos)
+        return api_response(alunos)
     except Exception as e:
         logger.error(f"Exceção na busca: {e}")
         return jsonify({"erro": "Erro interno ao buscar alunos"}), 500
@@ -63,7 +87,7 @@ def buscar_por_id():
         
         if aluno:
             enrich_with_call_count(aluno)
-            return jsonify(aluno)
+            return api_response(aluno)
         else:
             return jsonify({"erro": "Aluno não encontrado"}), 404
             
@@ -106,6 +130,79 @@ def limpar_paineis():
     else:
         return jsonify({"erro": "Falha ao limpar painéis"}), 500
 
+@bp.route('/sophia/status', methods=['GET'])
+@login_required
+def sophia_status():
+    """Estado do circuit breaker e do limite de concorrência do cliente SophiA."""
+    return api_response(sophia.get_guard().stats())
+
+@bp.route('/cache/stats', methods=['GET'])
+@login_required
+def cache_stats():
+    """Hit/miss por operação cacheável (contadores do processo que atendeu)."""
+    return api_response(cache.stats())
+
+# --- ANALYTICS ---
+
+ANALYTICS_MAX_DAYS = 62
+
+@bp.route('/analytics', methods=['GET'])
+@login_required
+def analytics():
+    """
+    Contadores agregados de chamadas por dia (coleção, hora, turma, rechamadas).
+    Parâmetros opcionais: ?inicio=YYYY-MM-DD&fim=YYYY-MM-DD (padrão: hoje).
+    """
+    hoje = firestore.local_now().date()
+    try:
+        fim = datetime.strptime(request.args['fim'], "%Y-%m-%d").date() if request.args.get('fim') else hoje
+        inicio = datetime.strptime(request.args['inicio'], "%Y-%m-%d").date() if request.args.get('inicio') else fim
+    except ValueError:
+        return jsonify({"erro": "Datas devem estar no formato YYYY-MM-DD"}), 400
+
+    if inicio > fim:
+        return jsonify({"erro": "'inicio' posterior a 'fim'"}), 400
+    if (fim - inicio) > timedelta(days=ANALYTICS_MAX_DAYS):
+        return jsonify({"erro": f"Intervalo máximo de {ANALYTICS_MAX_DAYS} dias"}), 400
+
+    return api_response(firestore.get_call_analytics(inicio, fim))
+
+# --- EXPORTAÇÃO DE HISTÓRICO ---
+
+@bp.route('/exportar-chamadas', methods=['GET'])
+@login_required
+def exportar_chamadas():
+    """
+    Exporta o histórico de chamadas em streaming (memória constante).
+    Parâmetros: ?inicio=YYYY-MM-DD&fim=YYYY-MM-DD&formato=csv|ndjson&segmento=...&aluno=...
+    """
+    try:
+        inicio, fim = export.parse_range(request.args.get('inicio'), request.args.get('fim'))
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    formato = request.args.get('formato', 'csv').lower()
+    if formato not in export.EXPORT_FORMATS:
+        return jsonify({"erro": f"Formato deve ser um de {list(export.EXPORT_FORMATS)}"}), 400
+
+    try:
+        colecoes = export.resolve_collections(request.args.get('segmento'))
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    # Checado antes do streaming: depois do primeiro byte não dá mais para devolver erro
+    if not firestore.get_db():
+        return jsonify({"erro": "Banco de dados indisponível"}), 503
+
+    logger.info(f"EXPORTAÇÃO por {session['user'].get('email')}: {inicio} a {fim}, formato={formato}, "
+                f"segmento={request.args.get('segmento')}, aluno={request.args.get('aluno')}")
+
+    linhas = export.iter_export_lines(inicio, fim, formato, colecoes, request.args.get('aluno'))
+    mimetype = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    filename = f"chamadas_{inicio}_{fim}.{formato}"
+    return Response(stream_with_context(linhas), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 # --- NOVAS ROTAS PARA RESPONSÁVEIS ---
 
 @bp.route('/aluno/<student_id>/responsaveis', methods=['GET'])
@@ -117,7 +214,7 @@ def listar_responsaveis(student_id):
     try:
         # Não precisamos mais passar o nome, o backend resolve
         responsaveis = sophia.get_student_responsibles(student_id)
-        return jsonify(responsaveis)
+        return api_response(responsaveis)
     except Exception as e:
         logger.error(f"Erro na rota de responsáveis: {e}")
         return jsonify({"erro": "Erro interno ao buscar responsáveis"}), 500
@@ -1,5 +1,7 @@
-from flask import Blueprint, render_template, session, redirect, url_for
+from datetime import timedelta
+from flask import Blueprint, render_template, session, redirect, url_for, request
 from functools import wraps
+from app.services import firestore
 
 bp = Blueprint('main', __name__)
 
@@ -22,6 +24,27 @@ def index():
 def terminal():
     return render_template('terminal.html')
 
+@bp.route('/analytics')
+@login_required
+def analytics():
+    """
+    Dashboard simples de chamadas dos últimos dias (?dias=N, padrão 7).
+    Lê apenas os documentos diários de analytics (N leituras).
+    """
+    dias = min(max(request.args.get('dias', 7, type=int), 1), 31)
+    fim = firestore.local_now().date()
+    inicio = fim - timedelta(days=dias - 1)
+    relatorio = firestore.get_call_analytics(inicio, fim)
+
+    # Consolida o período somando os mapas diários
+    consolidado = {'por_colecao': {}, 'por_hora': {}, 'por_turma': {}}
+    for dia in relatorio:
+        for chave, mapa in consolidado.items():
+            for nome, valor in dia[chave].items():
+                mapa[nome] = mapa.get(nome, 0) + valor
+
+    return render_template('analytics.html', relatorio=relatorio, consolidado=consolidado, dias=dias)
+
 @bp.route('/painel')
 def painel():
     """
@@ -30,25 +53,25 @@ def painel():
     """
     return render_template('painel.html')
 
-@bp.route('/painel-infantil')
-def painel_infantil():
-    """
-    Renderiza o painel conectado à coleção 'chamados_ei'.
-    """
-    return render_template('painel_base.html', collection_name='chamados_ei')
+# --- PAINÉIS POR SEGMENTO ---
+# As rotas /painel-infantil, /painel-fundamental, /painel-1anos (e as de outras
+# unidades/shards) vêm da tabela de roteamento (app.routing_table), não de código.
 
-@bp.route('/painel-fundamental')
-def painel_fundamental():
+def render_panel(collection_name):
     """
-    Renderiza o painel conectado à coleção 'chamados_fund'.
-    Nota: Agora exclui turmas de 1º ano (1A, 1B, 1C).
+    Renderiza o painel conectado à coleção informada, já com as chamadas ativas
+    embutidas (o listener do Firestore só entrega as mudanças depois).
     """
-    return render_template('painel_base.html', collection_name='chamados_fund')
+    return render_template('painel_base.html', collection_name=collection_name,
+                           initial_calls=firestore.get_active_calls(collection_name))
 
-@bp.route('/painel-1anos')
-def painel_1anos():
+def register_panel_routes(app):
     """
-    NOVA ROTA: Renderiza o painel exclusivo para 1ºs Anos.
-    Conectado à coleção 'chamados_1ano'.
+    Registra um blueprint 'paineis' com uma rota por painel da tabela de roteamento.
+    Criado por chamada (e não no módulo) porque as rotas dependem da tabela carregada.
     """
-    return render_template('painel_base.html', collection_name='chamados_1ano')
\ No newline at end of file
+    paineis = Blueprint('paineis', __name__)
+    for endpoint, route, collection_name in app.routing_table.panels():
+        paineis.add_url_rule(route, endpoint=endpoint, view_func=render_panel,
+                             defaults={'collection_name': collection_name})
+    app.register_blueprint(paineis)
@@ -0,0 +1,122 @@
+import gzip
+import json
+import time
+import logging
+from flask import request, Response
+
+logger = logging.getLogger(__name__)
+
+# Dependências opcionais (todas em requirements.txt): sem elas caímos no json da
+# stdlib / só gzip / só JSON.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPES = ('application/x-msgpack', 'application/msgpack')
+# Exportações CSV/NDJSON são streamed e ficam de fora (ver compress_response)
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-msgpack')
+# Abaixo disso o cabeçalho gzip custa mais do que economiza
+MIN_COMPRESS_BYTES = 1024
+
+
+def _dumps_json(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _project(data, fields):
+    """Mantém só as chaves pedidas em ?fields=a,b (em dict ou lista de dicts)."""
+    if isinstance(data, dict):
+        return {k: v for k, v in data.items() if k in fields}
+    if isinstance(data, list):
+        return [_project(item, fields) if isinstance(item, dict) else item for item in data]
+    return data
+
+
+def _wants_msgpack():
+    if msgpack is None:
+        return False
+    best = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES)
+    return best in MSGPACK_MIMETYPES
+
+
+def api_response(data, status=200):
+    """
+    Substituto do `jsonify` para o blueprint /api.
+
+    - JSON compacto (orjson quando instalado, sem espaços e sem escapar acentos);
+    - `?fields=id,nomeCompleto` devolve apenas essas chaves;
+    - `Accept: application/x-msgpack` devolve MessagePack (se instalado).
+    A compressão é feita depois, em `compress_response`.
+    """
+    fields = request.args.get('fields')
+    if fields:
+        data = _project(data, {f.strip() for f in fields.split(',') if f.strip()})
+
+    start = time.perf_counter()
+    if _wants_msgpack():
+        body, mimetype = msgpack.packb(data, use_bin_type=True), 'application/x-msgpack'
+    else:
+        body, mimetype = _dumps_json(data), 'application/json'
+    ser_ms = (time.perf_counter() - start) * 1000
+
+    response = Response(body, status=status, mimetype=mimetype)
+    response.headers.add('Server-Timing', f"ser;dur={ser_ms:.2f}")
+    response.vary.add('Accept')
+    return response
+
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """
+    after_request: comprime respostas JSON/MessagePack conforme o Accept-Encoding.
+    `X-Uncompressed-Length` e o Server-Timing `comp` permitem medir o ganho no DevTools.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers
+            or not 200 <= response.status_code < 300):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+
+    encoding = _negotiate_encoding()
+    if not encoding:
+        return response
+
+    start = time.perf_counter()
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=5)
+    else:
+        compressed = gzip.compress(body, compresslevel=6)
+    comp_ms = (time.perf_counter() - start) * 1000
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['X-Uncompressed-Length'] = str(len(body))
+    response.headers.add('Server-Timing', f"comp;dur={comp_ms:.2f}")
+    logger.debug(f"{request.path}: {len(body)}B -> {len(compressed)}B ({encoding}, {comp_ms:.1f}ms)")
+    return response
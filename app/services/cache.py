@@ -0,0 +1,252 @@
+import time
+import logging
+import threading
+from cachelib import SimpleCache, FileSystemCache, RedisCache
+
+logger = logging.getLogger(__name__)
+
+# Backend do processo. Começa em memória (útil fora do app/CLI) e é trocado
+# por `init_app` conforme CACHE_TYPE.
+_backend = SimpleCache(threshold=500)
+_shared_backend = False
+
+_namespaces = {}
+_namespaces_lock = threading.Lock()
+
+CACHE_TYPES = ('memory', 'filesystem', 'redis')
+
+
+class CacheConfigError(ValueError):
+    """CACHE_TYPE inválido ou sem dependência instalada (detectado na inicialização)."""
+
+
+def create_backend(config, redis_client=None):
+    """
+    Cria o backend cachelib a partir da config.
+
+    CACHE_TYPE:
+    - 'memory'     : SimpleCache por processo (padrão; cada worker tem o seu);
+    - 'filesystem' : FileSystemCache em CACHE_DIR (compartilhado entre workers da máquina);
+    - 'redis'      : RedisCache em CACHE_REDIS_URL (compartilhado entre instâncias).
+    `redis_client` permite injetar qualquer cliente compatível com Redis (ex: o stand-in
+    de tests/redis_standin.py). Todos respeitam CACHE_THRESHOLD (eviction por tamanho)
+    exceto o Redis, que usa maxmemory.
+
+    Config inválida derruba a inicialização: cair silenciosamente para memória faria
+    cada worker ter o seu cache, justamente o que o backend compartilhado evita.
+    """
+    cache_type = (config.get('CACHE_TYPE') or 'memory').lower()
+    if cache_type not in CACHE_TYPES:
+        raise CacheConfigError(f"CACHE_TYPE '{cache_type}' inválido. Use um de {CACHE_TYPES}.")
+    threshold = int(config.get('CACHE_THRESHOLD') or 500)
+    prefix = config.get('CACHE_KEY_PREFIX') or 'chamada-visual:'
+
+    if cache_type == 'filesystem':
+        return FileSystemCache(config.get('CACHE_DIR') or '/tmp/chamada-visual-cache', threshold=threshold)
+
+    if cache_type == 'redis':
+        if redis_client is None:
+            try:
+                import redis
+            except ImportError:
+                raise CacheConfigError("CACHE_TYPE='redis' exige o pacote 'redis' (pip install -r requirements.txt).")
+            redis_client = redis.from_url(config.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0')
+        return RedisCache(host=redis_client, key_prefix=prefix)
+
+    return SimpleCache(threshold=threshold)
+
+
+def init_app(app, redis_client=None):
+    global _backend, _shared_backend
+    _backend = create_backend(app.config, redis_client)
+    _shared_backend = not isinstance(_backend, SimpleCache)
+    logger.info(f"Cache inicializado: {type(_backend).__name__}")
+
+
+class _Flight:
+    """Cálculo em andamento de uma chave: quem chega depois espera o resultado (ou o erro)."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class _Flights:
+    """Registro dos cálculos em andamento neste processo, um por chave."""
+
+    def __init__(self):
+        self._flights = {}
+        self._guard = threading.Lock()
+
+    def join(self, key):
+        """Retorna (flight, dono). O dono deve chamar `finish` ao terminar."""
+        with self._guard:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def finish(self, key, flight):
+        with self._guard:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.done.set()
+
+
+_flights = _Flights()
+
+
+class CacheNamespace:
+    """
+    Operação cacheável declarada por um serviço (ex: 'busca', 'foto_aluno').
+
+    Valores são guardados embrulhados em tupla para que `None` também possa ser
+    cacheado (ex: "aluno não encontrado"). Erros do backend contam como miss:
+    o cache nunca derruba uma chamada.
+    """
+
+    def __init__(self, name, default_timeout=300, lock_timeout=20):
+        self.name = name
+        self.default_timeout = default_timeout
+        self.lock_timeout = lock_timeout
+        self._metrics = {'hits': 0, 'misses': 0, 'sets': 0, 'coalesced': 0, 'shared_errors': 0, 'errors': 0}
+        self._metrics_lock = threading.Lock()
+
+    def _bump(self, metric):
+        with self._metrics_lock:
+            self._metrics[metric] += 1
+
+    def _key(self, key):
+        if isinstance(key, (tuple, list)):
+            key = '|'.join(str(k) for k in key)
+        return f"{self.name}:{key}"
+
+    def _get_wrapped(self, full_key):
+        try:
+            return _backend.get(full_key)
+        except Exception as e:
+            self._bump('errors')
+            logger.warning(f"Cache '{self.name}': erro na leitura ({e})")
+            return None
+
+    def get(self, key, default=None):
+        wrapped = self._get_wrapped(self._key(key))
+        if wrapped is None:
+            self._bump('misses')
+            return default
+        self._bump('hits')
+        return wrapped[0]
+
+    def set(self, key, value, timeout=None):
+        try:
+            _backend.set(self._key(key), (value,), timeout=self.default_timeout if timeout is None else timeout)
+            self._bump('sets')
+        except Exception as e:
+            self._bump('errors')
+            logger.warning(f"Cache '{self.name}': erro na gravação ({e})")
+
+    def delete(self, key):
+        try:
+            _backend.delete(self._key(key))
+        except Exception as e:
+            self._bump('errors')
+            logger.warning(f"Cache '{self.name}': erro ao remover ({e})")
+
+    def get_or_set(self, key, compute, timeout=None):
+        """
+        Retorna o valor cacheado ou calcula com `compute()` uma única vez (single-flight).
+
+        Threads do mesmo processo esperam o cálculo em andamento por até `lock_timeout`
+        e recebem o mesmo resultado; se ele falhar, recebem a mesma exceção (sem
+        recalcular uma a uma, o que enfileiraria timeouts com o SophiA fora). Com backend
+        compartilhado (filesystem/redis) um lock no próprio backend (`add`) evita que
+        outros workers recalculem a mesma chave; quem espera faz polling até
+        `lock_timeout` e, se o dono travar, calcula por conta própria. Exceções de
+        `compute` não são cacheadas.
+        """
+        full_key = self._key(key)
+        wrapped = self._get_wrapped(full_key)
+        if wrapped is not None:
+            self._bump('hits')
+            return wrapped[0]
+
+        flight, owner = _flights.join(full_key)
+        if not owner:
+            if flight.done.wait(self.lock_timeout):
+                if flight.error is not None:
+                    self._bump('shared_errors')
+                    raise flight.error
+                self._bump('coalesced')
+                return flight.value
+            # Dono travado: calcula por conta própria
+            return self._compute(key, full_key, compute, timeout)
+
+        try:
+            flight.value = self._compute(key, full_key, compute, timeout)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            _flights.finish(full_key, flight)
+
+    def _compute(self, key, full_key, compute, timeout):
+        wrapped = self._get_wrapped(full_key)
+        if wrapped is not None:
+            self._bump('coalesced')
+            return wrapped[0]
+
+        lock_key = f"__lock__:{full_key}"
+        owns_lock = True
+        if _shared_backend:
+            try:
+                owns_lock = _backend.add(lock_key, 1, timeout=self.lock_timeout)
+            except Exception:
+                owns_lock = True
+            if not owns_lock:
+                deadline = time.monotonic() + self.lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    wrapped = self._get_wrapped(full_key)
+                    if wrapped is not None:
+                        self._bump('coalesced')
+                        return wrapped[0]
+
+        self._bump('misses')
+        try:
+            value = compute()
+            self.set(key, value, timeout)
+            return value
+        finally:
+            if _shared_backend and owns_lock:
+                try:
+                    _backend.delete(lock_key)
+                except Exception:
+                    pass
+
+    def stats(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        lookups = metrics['hits'] + metrics['misses'] + metrics['coalesced'] + metrics['shared_errors']
+        metrics['hit_ratio'] = round((metrics['hits'] + metrics['coalesced']) / lookups, 3) if lookups else None
+        metrics['ttl'] = self.default_timeout
+        return metrics
+
+
+def namespace(name, default_timeout=300, lock_timeout=20):
+    """Declara (ou reaproveita) uma operação cacheável. Use no topo do módulo do serviço."""
+    with _namespaces_lock:
+        ns = _namespaces.get(name)
+        if ns is None:
+            ns = _namespaces[name] = CacheNamespace(name, default_timeout, lock_timeout)
+        return ns
+
+
+def stats():
+    """Métricas de hit/miss por operação (contadores deste processo)."""
+    return {
+        "backend": type(_backend).__name__,
+        "operacoes": {name: ns.stats() for name, ns in sorted(_namespaces.items())},
+    }
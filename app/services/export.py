@@ -0,0 +1,130 @@
+import io
+import csv
+import json
+import sys
+import logging
+from datetime import datetime, timedelta
+import click
+from app.services import firestore
+
+logger = logging.getLogger(__name__)
+
+# Colunas exportadas. A foto (base64) fica de fora de propósito: é o grosso do documento.
+EXPORT_FIELDS = ['data_chamada', 'horario', 'colecao', 'id', 'matricula', 'nomeCompleto', 'turma', 'doc_id']
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_MAX_DAYS = 400
+
+# Células que o Excel/LibreOffice interpretariam como fórmula (CSV injection)
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_range(inicio, fim=None, max_days=EXPORT_MAX_DAYS):
+    """
+    Converte 'YYYY-MM-DD' em (data_inicial, data_final), com `fim` padrão igual a
+    `inicio`. Usado pelo endpoint e pelo CLI: ValueError com mensagem para o usuário.
+    """
+    try:
+        start_date = datetime.strptime(inicio or '', "%Y-%m-%d").date()
+        end_date = datetime.strptime(fim, "%Y-%m-%d").date() if fim else start_date
+    except ValueError:
+        raise ValueError("Informe 'inicio' (e opcionalmente 'fim') no formato YYYY-MM-DD")
+    if start_date > end_date:
+        raise ValueError("'inicio' posterior a 'fim'")
+    if (end_date - start_date) > timedelta(days=max_days):
+        raise ValueError(f"Intervalo máximo de {max_days} dias")
+    return start_date, end_date
+
+
+def _to_row(coll_name, doc_id, data):
+    ts = data.get('timestamp')
+    return {
+        'data_chamada': data.get('data_chamada', ''),
+        'horario': ts.isoformat() if hasattr(ts, 'isoformat') else '',
+        'colecao': coll_name,
+        'id': data.get('id', ''),
+        'matricula': data.get('matricula', ''),
+        'nomeCompleto': data.get('nomeCompleto', ''),
+        'turma': data.get('turma', ''),
+        'doc_id': doc_id,
+    }
+
+
+def _csv_safe(row):
+    """Prefixa com ' os valores que começam como fórmula (nomes vêm do SophiA/cliente)."""
+    return {k: f"'{v}" if isinstance(v, str) and v.startswith(_FORMULA_PREFIXES) else v
+            for k, v in row.items()}
+
+
+def resolve_collections(segmento=None):
+    """
+    Coleções a exportar (None = todas). Validado antes de começar o streaming,
+    pois depois que a resposta começou não dá mais para devolver um 400.
+    """
+    if not segmento:
+        return None
+    collections = firestore.get_routing_table().collections_for_segment(segmento)
+    if not collections:
+        raise ValueError(f"Segmento/coleção desconhecido: '{segmento}'")
+    return collections
+
+
+def iter_export_lines(start_date, end_date, formato='csv', collections=None, student_id=None):
+    """
+    Gera as linhas (str) da exportação, uma por chamada (o CSV começa pelo cabeçalho),
+    lendo o Firestore página a página. Nada é acumulado em memória: serve tanto para
+    a resposta HTTP em streaming quanto para o CLI.
+    """
+    rows = (_to_row(*item) for item in firestore.iter_calls(start_date, end_date, collections, student_id))
+
+    if formato == 'ndjson':
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow(_csv_safe(row))
+        yield buffer.getvalue()
+
+
+def register_cli(app):
+    """Registra `flask exportar-chamadas` no CLI da aplicação."""
+
+    @app.cli.command('exportar-chamadas')
+    @click.option('--inicio', required=True, help='Data inicial (YYYY-MM-DD).')
+    @click.option('--fim', help='Data final (YYYY-MM-DD). Padrão: igual a --inicio.')
+    @click.option('--formato', type=click.Choice(EXPORT_FORMATS), default='csv', show_default=True)
+    @click.option('--segmento', help='Segmento ou coleção (ex: fundamental, chamados_ei).')
+    @click.option('--aluno', 'student_id', help='ID do aluno.')
+    @click.option('--saida', type=click.Path(dir_okay=False, writable=True), help='Arquivo de saída. Padrão: stdout.')
+    def exportar_chamadas(inicio, fim, formato, segmento, student_id, saida):
+        """Exporta o histórico de chamadas em CSV/NDJSON."""
+        try:
+            start_date, end_date = parse_range(inicio, fim)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+
+        try:
+            collections = resolve_collections(segmento)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        if not firestore.get_db():
+            raise click.ClickException("Firestore indisponível.")
+
+        out = open(saida, 'w', encoding='utf-8', newline='') if saida else sys.stdout
+        total = 0
+        try:
+            for line in iter_export_lines(start_date, end_date, formato, collections, student_id):
+                out.write(line)
+                total += 1
+        finally:
+            if saida:
+                out.close()
+        if formato == 'csv':
+            total -= 1  # cabeçalho
+        click.echo(f"{total} chamada(s) exportada(s).", err=True)
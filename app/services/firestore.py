@@ -1,10 +1,15 @@
 import logging
-import re
-from datetime import datetime, time
+import time as _time
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
 from firebase_admin import firestore
-from flask import current_app
+from flask import current_app, has_app_context
+from app.services import cache
+from app.services.profiling import count as count_io
+from app.services.routing import RoutingTable, DEFAULT_ROUTING_TABLE
 
 logger = logging.getLogger(__name__)
+_DEFAULT_TABLE = RoutingTable(DEFAULT_ROUTING_TABLE)
 
 def get_db():
     try:
@@ -15,49 +20,34 @@ def get_db():
         logger.error(f"Erro ao obter cliente Firestore: {e}")
         return None
 
+def get_routing_table():
+    """
+    Tabela de roteamento do app atual. Exige contexto de aplicação: em threads
+    auxiliares use `app.app_context()`, senão a contagem/gravação iria para a
+    coleção da tabela padrão em vez da configurada.
+    """
+    if not has_app_context():
+        raise RuntimeError("Tabela de roteamento indisponível fora do contexto da aplicação.")
+    table = getattr(current_app, 'routing_table', None)
+    if table is None:
+        logger.warning("app.routing_table ausente: usando a tabela de roteamento padrão.")
+        return _DEFAULT_TABLE
+    return table
+
 def _get_collection_name(turma):
     """
     Determina a coleção do Firestore baseada no nome da turma.
+    As regras vêm da tabela de roteamento carregada na inicialização (app.routing_table);
+    a unidade é deduzida pelos `padroes_turma`, nunca informada pelo cliente.
     """
-    if not turma: return "chamados"
-    
-    turma = turma.strip().upper()
-    
-    # LOG DE DIAGNÓSTICO
-    logger.info(f"--> CLASSIFICANDO TURMA: '{turma}'")
-    
-    # 1. Regra para Educação Infantil (EI e G1-G5)
-    # Ex: 'EI-4B-T-2039', 'G4 A'
-    if turma.startswith('EI') or turma.startswith('G'):
-        return "chamados_ei"
-    
-    # 2. Regra Específica para 1ºs Anos (1A, 1B, 1C...)
-    # Regex Explicado:
-    # (?:^|[\s\-])  : O início deve ser o começo da linha (^) OU um separador (espaço ou traço).
-    #                 Isso permite casar 'AI-1A' (por causa do traço) ou '1A' direto.
-    # 1             : O número 1 literal.
-    # [\sº°\-]?     : Um separador opcional (ex: '1-A', '1ºA', '1A').
-    # [A-Z]         : A letra da turma.
-    # (?![0-9])     : Lookahead negativo: garante que o próximo char NÃO é número (evita 10, 11).
-    
-    # Testes Mentais:
-    # 'AI-1A-M' -> Casa (devido ao traço antes do 1)
-    # '1B'      -> Casa (início de string)
-    # 'AI-2A'   -> Não casa
-    # '11A'     -> Não casa (separador previne início, lookahead previne fim)
-    
-    if re.search(r'(?:^|[\s\-])1[\sº°\-]?[A-Z](?![0-9])', turma):
-        logger.info(f"--> Destino Definido: CHAMADOS_1ANO")
-        return "chamados_1ano"
-
-    # 3. Regra para Fundamental (Anos Iniciais e Finais - exceto 1º ano)
-    logger.info(f"--> Destino Definido: CHAMADOS_FUND (Padrão)")
-    return "chamados_fund"
+    return get_routing_table().resolve(turma)
 
 def call_student(student_data):
     db = get_db()
     if not db: return False
 
+    # 'campus' vindo do navegador não escolhe a coleção nem vai para o documento
+    student_data.pop("campus", None)
     turma = student_data.get("turma", "")
     collection_name = _get_collection_name(turma)
 
@@ -71,12 +61,183 @@ def call_student(student_data):
         student_data['data_chamada'] = datetime.now().strftime("%Y-%m-%d")
         
         db.collection(collection_name).add(student_data)
+        count_io('firestore_writes')
+        _panel_snapshot_cache.delete(collection_name)
         logger.info(f"GRAVAÇÃO SUCESSO: Aluno {student_data.get('id')} - {student_data.get('nomeCompleto')} em '{collection_name}'")
-        return True
     except Exception as e:
         logger.error(f"ERRO GRAVAÇÃO: {e}")
         return False
 
+    # Analytics é secundário: uma falha aqui não pode invalidar a chamada já gravada.
+    try:
+        _record_call_analytics(db, collection_name, student_data)
+    except Exception as e:
+        logger.error(f"ERRO ANALYTICS: {e}")
+    return True
+
+# --- ANALYTICS INCREMENTAL ---
+# Um documento por dia em 'analytics_chamadas' acumula os contadores (Increment atômico),
+# e uma subcoleção 'alunos' guarda o horário da última chamada de cada aluno no dia.
+# Assim um relatório de N dias custa N leituras, sem varrer as coleções 'chamados_*'.
+
+ANALYTICS_COLLECTION = "analytics_chamadas"
+
+def local_now():
+    """Agora no fuso da escola (TIMEZONE). No App Engine o relógio do processo é UTC."""
+    tz_name = current_app.config.get('TIMEZONE') if has_app_context() else None
+    return datetime.now(ZoneInfo(tz_name or 'America/Sao_Paulo'))
+
+def _record_call_analytics(db, collection_name, student_data):
+    """
+    Atualiza os contadores do dia para uma chamada recém-gravada.
+
+    Dia e hora são do fuso local (TIMEZONE). Proxy de tempo de retirada: quando o
+    mesmo aluno é chamado de novo no dia, o intervalo desde a chamada anterior é
+    somado em 'espera_total_seg' (o aluno ainda não tinha sido retirado).
+    """
+    now = local_now()
+    now_epoch = now.timestamp()
+    day_ref = db.collection(ANALYTICS_COLLECTION).document(now.strftime("%Y-%m-%d"))
+
+    turma = (student_data.get("turma") or "SEM TURMA").strip().upper()
+    counters = {
+        "total": firestore.Increment(1),
+        "por_colecao": {collection_name: firestore.Increment(1)},
+        "por_hora": {now.strftime("%H"): firestore.Increment(1)},
+        "por_turma": {turma: firestore.Increment(1)},
+        "atualizado_em": firestore.SERVER_TIMESTAMP,
+    }
+
+    student_id = student_data.get("id")
+    if student_id:
+        aluno_ref = day_ref.collection("alunos").document(str(student_id))
+        counters.update(_update_student_analytics(db.transaction(), aluno_ref, now_epoch))
+
+    # Só Increments: atômico sem transação, e sem disputar o documento do dia no pico
+    day_ref.set(counters, merge=True)
+    count_io('firestore_writes')
+
+def _recall_counters(aluno_data, now_epoch):
+    """Contadores extras do dia conforme o histórico do aluno (None = primeira chamada)."""
+    if aluno_data is None:
+        return {"alunos_distintos": firestore.Increment(1)}
+    ultima = aluno_data.get("ultima_chamada")
+    if not ultima:
+        return {}
+    return {
+        "rechamadas": firestore.Increment(1),
+        "espera_total_seg": firestore.Increment(max(0, int(now_epoch - ultima))),
+    }
+
+@firestore.transactional
+def _update_student_analytics(transaction, aluno_ref, now_epoch):
+    """
+    Leitura e escrita do documento do aluno na mesma transação: duas chamadas
+    simultâneas do mesmo aluno (duplo toque, dois terminais) não contam o aluno
+    duas vezes em 'alunos_distintos' nem perdem a rechamada. Só o documento do
+    aluno entra na transação; os contadores retornados vão para o do dia fora dela.
+    """
+    aluno_doc = aluno_ref.get(transaction=transaction)
+    count_io('firestore_reads')
+    extra = _recall_counters((aluno_doc.to_dict() or {}) if aluno_doc.exists else None, now_epoch)
+
+    transaction.set(aluno_ref, {
+        "ultima_chamada": now_epoch,
+        "chamadas": firestore.Increment(1),
+    }, merge=True)
+    count_io('firestore_writes')
+    return extra
+
+def get_call_analytics(start_date, end_date):
+    """
+    Retorna os contadores diários entre start_date e end_date (date, inclusivo).
+    Custa uma leitura de documento por dia do intervalo.
+    """
+    db = get_db()
+    if not db: return []
+
+    days = []
+    current = start_date
+    while current <= end_date:
+        days.append(current.strftime("%Y-%m-%d"))
+        current += timedelta(days=1)
+
+    refs = [db.collection(ANALYTICS_COLLECTION).document(d) for d in days]
+    try:
+        snapshots = {snap.id: snap for snap in db.get_all(refs)}
+        count_io('firestore_reads', len(refs))
+    except Exception as e:
+        logger.error(f"Erro ao ler analytics: {e}")
+        return []
+
+    report = []
+    for day in days:
+        snap = snapshots.get(day)
+        data = snap.to_dict() if snap is not None and snap.exists else {}
+        rechamadas = data.get("rechamadas", 0)
+        espera_total = data.get("espera_total_seg", 0)
+        report.append({
+            "data": day,
+            "total": data.get("total", 0),
+            "alunos_distintos": data.get("alunos_distintos", 0),
+            "rechamadas": rechamadas,
+            "espera_media_min": round(espera_total / rechamadas / 60, 1) if rechamadas else None,
+            "por_colecao": data.get("por_colecao", {}),
+            "por_hora": data.get("por_hora", {}),
+            "por_turma": data.get("por_turma", {}),
+        })
+    return report
+
+# --- SNAPSHOT INICIAL DOS PAINÉIS ---
+# Os painéis recebem as chamadas ativas já no HTML (primeira pintura sem esperar o
+# Firebase JS SDK). Cache curto por coleção com single-flight: vários TVs recarregando
+# ao mesmo tempo custam uma única consulta. Invalidado a cada nova chamada/limpeza.
+
+PANEL_MAX_DISPLAY = 10
+PANEL_MAX_AGE_SECONDS = 10 * 60
+_panel_snapshot_cache = cache.namespace('painel_snapshot', default_timeout=5)
+
+def get_active_calls(collection_name):
+    """
+    Retorna as chamadas ainda visíveis (últimos 10 min, no máximo 10) da coleção,
+    da mais recente para a mais antiga, prontas para serializar no template.
+    """
+    ttl = current_app.config.get('PANEL_SNAPSHOT_TTL', 5) if current_app else 5
+    try:
+        return _panel_snapshot_cache.get_or_set(collection_name, lambda: _query_active_calls(collection_name), timeout=ttl)
+    except Exception as e:
+        logger.error(f"Erro ao obter snapshot do painel '{collection_name}': {e}")
+        return []
+
+def _query_active_calls(collection_name):
+    db = get_db()
+    if not db: return []
+
+    docs = (db.collection(collection_name)
+            .order_by("timestamp", direction=firestore.Query.DESCENDING)
+            .limit(PANEL_MAX_DISPLAY)
+            .stream())
+
+    cutoff = _time.time() - PANEL_MAX_AGE_SECONDS
+    active = []
+    read = 0
+    for doc in docs:
+        read += 1
+        data = doc.to_dict()
+        ts = data.get('timestamp')
+        if not ts or not hasattr(ts, 'timestamp'): continue
+        epoch = ts.timestamp()
+        if epoch < cutoff: continue
+        active.append({
+            "docId": doc.id,
+            "nomeCompleto": data.get("nomeCompleto"),
+            "turma": data.get("turma"),
+            "fotoUrl": data.get("fotoUrl"),
+            "timestampMs": int(epoch * 1000),
+        })
+    count_io('firestore_reads', max(read, 1))
+    return active
+
 def get_student_call_count(student_id, turma):
     """
     Conta chamadas de hoje com logs de diagnóstico.
@@ -116,6 +277,9 @@ def get_student_call_count(student_id, turma):
             if is_today:
                 count += 1
         
+        # Firestore cobra no mínimo 1 leitura por consulta, mesmo vazia
+        count_io('firestore_reads', max(total_found, 1))
+
         if total_found > 0 or count > 0:
             logger.info(f"CONTAGEM ID {target_id} em '{collection_name}': Encontrados={total_found}, Hoje={count}")
             
@@ -124,17 +288,79 @@ def get_student_call_count(student_id, turma):
         logger.error(f"Erro ao contar chamadas para {student_id}: {e}")
         return 0
 
+# --- EXPORTAÇÃO DE HISTÓRICO ---
+
+EXPORT_PAGE_SIZE = 500
+
+def _paginate(query, page_size):
+    """Percorre uma consulta em páginas com cursor (start_after); memória constante."""
+    last_doc = None
+    while True:
+        page = query.limit(page_size)
+        if last_doc is not None:
+            page = page.start_after(last_doc)
+        docs = list(page.stream())
+        count_io('firestore_reads', max(len(docs), 1))
+        yield from docs
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+def iter_calls(start_date, end_date, collections=None, student_id=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Gera (coleção, id do documento, dados) das chamadas entre start_date e end_date (date, inclusivo).
+
+    Sem filtro de aluno: faixa em 'timestamp' ordenada, coleção por coleção.
+    Com filtro de aluno: igualdade em 'id' paginada pelo ID do documento (não exige
+    índice composto) e a faixa de datas é aplicada aqui — um aluno tem poucos documentos.
+    Sem Firestore levanta RuntimeError: uma exportação vazia passaria por "sem chamadas".
+    """
+    db = get_db()
+    if not db:
+        raise RuntimeError("Firestore indisponível")
+
+    start_dt = datetime.combine(start_date, time.min)
+    end_dt = datetime.combine(end_date + timedelta(days=1), time.min)
+    if collections is None:
+        collections = get_routing_table().all_collections()
+        extra = current_app.config.get('EXPORT_EXTRA_COLLECTIONS') if current_app else None
+        collections += [c.strip() for c in (extra or '').split(',') if c.strip() and c.strip() not in collections]
+
+    for coll_name in collections:
+        ref = db.collection(coll_name)
+        if student_id:
+            query = ref.where("id", "==", str(student_id)).order_by("__name__")
+        else:
+            query = (ref.where("timestamp", ">=", start_dt)
+                        .where("timestamp", "<", end_dt)
+                        .order_by("timestamp"))
+
+        for doc in _paginate(query, page_size):
+            data = doc.to_dict() or {}
+            if student_id:
+                ts = data.get("timestamp")
+                if not ts or not hasattr(ts, 'timestamp'): continue
+                naive = ts.replace(tzinfo=None) if getattr(ts, 'tzinfo', None) else ts
+                if not start_dt <= naive < end_dt: continue
+            yield coll_name, doc.id, data
+
 def clear_all_panels():
     db = get_db()
     if not db: return False
 
-    collections_to_clear = ["chamados", "chamados_ei", "chamados_fund", "chamados_1ano"]
+    collections_to_clear = get_routing_table().all_collections()
     
     try:
         for coll_name in collections_to_clear:
             docs = db.collection(coll_name).stream()
+            removed = 0
             for doc in docs:
                 doc.reference.delete()
+                removed += 1
+            count_io('firestore_reads', max(removed, 1))
+            count_io('firestore_writes', removed)
+        for coll_name in collections_to_clear:
+            _panel_snapshot_cache.delete(coll_name)
         logger.info("Todos os painéis foram limpos com sucesso.")
         return True
     except Exception as e:
@@ -0,0 +1,229 @@
+import os
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from flask import g, request, session
+
+logger = logging.getLogger(__name__)
+
+# Contadores da requisição atual. ContextVar (e não `g`) para que threads de
+# ThreadPoolExecutor possam somar no mesmo objeto via `bind_to_request`.
+_current_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """
+    Totais de I/O de uma requisição: leituras/escritas Firestore e chamadas SophiA.
+
+    `sophia_ms` soma a duração de cada chamada (com fotos em paralelo pode passar do
+    tempo da requisição); `sophia_wall_ms` é o tempo de relógio com ao menos uma
+    chamada SophiA em andamento.
+    """
+
+    def __init__(self):
+        self.firestore_reads = 0
+        self.firestore_writes = 0
+        self.sophia_calls = 0
+        self.sophia_ms = 0.0
+        self.sophia_wall_ms = 0.0
+        self._sophia_in_flight = 0
+        self._sophia_since = 0.0
+        # Perfis das threads auxiliares (bind_to_request) quando a requisição é perfilada
+        self.profile_workers = False
+        self.worker_profiles = []
+        self._lock = threading.Lock()
+
+    def add(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def _sophia_started(self, start):
+        with self._lock:
+            if self._sophia_in_flight == 0:
+                self._sophia_since = start
+            self._sophia_in_flight += 1
+
+    def _sophia_finished(self, start, end):
+        with self._lock:
+            self.sophia_calls += 1
+            self.sophia_ms += (end - start) * 1000
+            self._sophia_in_flight -= 1
+            if self._sophia_in_flight == 0:
+                self.sophia_wall_ms += (end - self._sophia_since) * 1000
+
+
+def count(field, amount=1):
+    """Soma `amount` no contador da requisição atual (no-op fora de requisição)."""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.add(field, amount)
+
+
+@contextmanager
+def sophia_call():
+    """Mede uma chamada ao SophiA (duração somada e tempo de relógio da requisição)."""
+    stats = _current_stats.get()
+    start = time.perf_counter()
+    if stats is not None:
+        stats._sophia_started(start)
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats._sophia_finished(start, time.perf_counter())
+
+
+def bind_to_request(fn):
+    """
+    Propaga os contadores da requisição atual para `fn` executada em outra thread.
+    Se a requisição está sendo perfilada, a thread ganha seu próprio cProfile, que é
+    somado ao .prof da requisição (o cProfile só enxerga a thread que o ativou).
+    """
+    stats = _current_stats.get()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current_stats.set(stats)
+        profiler = None
+        if stats is not None and stats.profile_workers:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+: um só profiler ativo por processo; a thread segue sem perfil
+                profiler = None
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                with stats._lock:
+                    stats.worker_profiles.append(profiler)
+            _current_stats.reset(token)
+    return wrapper
+
+
+def _dump_profile(profiler, worker_profiles, path):
+    """Grava o perfil da thread da requisição somado aos das threads auxiliares."""
+    combined = pstats.Stats(profiler)
+    for worker in worker_profiles:
+        try:
+            combined.add(worker)
+        except TypeError:
+            # Thread auxiliar sem nenhuma função registrada
+            pass
+    combined.dump_stats(path)
+
+
+def _prune_profiles(profile_dir, max_files):
+    """Mantém só os `max_files` .prof mais recentes (no App Engine /tmp consome RAM)."""
+    try:
+        entries = [e for e in os.scandir(profile_dir) if e.is_file() and e.name.endswith('.prof')]
+    except OSError:
+        return
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - max_files]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _is_operator():
+    operators = g.get('_profiling_operators', ())
+    user = session.get('user') or {}
+    return bool(operators) and user.get('email', '').lower() in operators
+
+
+def init_app(app):
+    """
+    Liga o profiling sob demanda na aplicação.
+
+    - Operador autorizado (e-mail em PROFILING_OPERATORS) envia o header `X-Profile: 1`:
+      os totais voltam nos headers da resposta.
+    - PROFILING_SAMPLE_RATE (0.0 a 1.0) amostra requisições comuns; os totais vão só para o log.
+    Em ambos os casos o cProfile (thread da requisição + threads de `bind_to_request`)
+    é salvo em PROFILING_DIR, mantendo no máximo PROFILING_MAX_FILES arquivos
+    (os mais antigos são apagados).
+    """
+    operators = {e.strip().lower() for e in (app.config.get('PROFILING_OPERATORS') or '').split(',') if e.strip()}
+    sample_rate = float(app.config.get('PROFILING_SAMPLE_RATE') or 0)
+    profile_dir = app.config.get('PROFILING_DIR')
+    max_files = int(app.config.get('PROFILING_MAX_FILES') or 20)
+    prune_lock = threading.Lock()
+
+    @app.before_request
+    def _start_request_stats():
+        g._profiling_operators = operators
+        _current_stats.set(RequestStats())
+        g._profile_start = time.perf_counter()
+
+        g._profile_expose = request.headers.get('X-Profile') == '1' and _is_operator()
+        g._profile_active = g._profile_expose or (sample_rate > 0 and random.random() < sample_rate)
+        g._profiler = None
+        if g._profile_active and profile_dir:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g._profiler = profiler
+                _current_stats.get().profile_workers = True
+            except ValueError:
+                # Outro profiler já ativo no processo (ex: requisição concorrente): só wall-clock
+                pass
+
+    @app.after_request
+    def _finish_request_stats(response):
+        if not g.get('_profile_active'):
+            return response
+
+        wall_ms = (time.perf_counter() - g._profile_start) * 1000
+        stats = _current_stats.get() or RequestStats()
+
+        profile_file = None
+        if g._profiler is not None:
+            g._profiler.disable()
+            try:
+                os.makedirs(profile_dir, exist_ok=True)
+                endpoint = (request.endpoint or 'unknown').replace('.', '_')
+                profile_file = os.path.join(profile_dir, f"{int(time.time() * 1000)}_{endpoint}_{int(wall_ms)}ms.prof")
+                _dump_profile(g._profiler, stats.worker_profiles, profile_file)
+                with prune_lock:
+                    _prune_profiles(profile_dir, max_files)
+            except OSError as e:
+                logger.error(f"Profiling: falha ao salvar {profile_file}: {e}")
+                profile_file = None
+
+        logger.info(
+            f"PROFILE {request.method} {request.path}: {wall_ms:.1f}ms | "
+            f"Firestore R={stats.firestore_reads} W={stats.firestore_writes} | "
+            f"SophiA chamadas={stats.sophia_calls} ({stats.sophia_wall_ms:.1f}ms relógio, {stats.sophia_ms:.1f}ms somados)"
+            + (f" | {profile_file}" if profile_file else "")
+        )
+
+        if g._profile_expose:
+            response.headers['X-Firestore-Reads'] = str(stats.firestore_reads)
+            response.headers['X-Firestore-Writes'] = str(stats.firestore_writes)
+            response.headers['X-Sophia-Calls'] = str(stats.sophia_calls)
+            response.headers['X-Sophia-Ms-Total'] = f"{stats.sophia_ms:.1f}"
+            response.headers.add('Server-Timing', f"app;dur={wall_ms:.1f}, sophia;dur={stats.sophia_wall_ms:.1f}")
+            if profile_file:
+                response.headers['X-Profile-File'] = os.path.basename(profile_file)
+        return response
+
+    @app.teardown_request
+    def _reset_request_stats(exc):
+        # Se a view levantou exceção o after_request não roda: garante que o profiler pare
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+        # set(None) em vez de reset(token): o teardown de respostas em streaming
+        # pode rodar em outro contexto
+        _current_stats.set(None)
@@ -0,0 +1,189 @@
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SophiaUnavailable(Exception):
+    """Levantada quando o circuito está aberto ou não há vaga para chamar o SophiA."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clássico (fechado -> aberto -> meio-aberto).
+
+    - Fechado: requisições passam; falhas consecutivas são contadas.
+    - Aberto: após `failure_threshold` falhas, tudo falha rápido por `reset_timeout` segundos.
+    - Meio-aberto: deixa passar UMA requisição de teste; sucesso fecha, falha reabre.
+    """
+    CLOSED = 'fechado'
+    OPEN = 'aberto'
+    HALF_OPEN = 'meio-aberto'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            # Meio-aberto: apenas uma requisição de teste por vez
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def cancel_probe(self):
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("SophiA recuperado: circuito fechado.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"SophiA instável: circuito aberto por {self.reset_timeout}s ({self._failures} falhas).")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class AdaptiveLimiter:
+    """
+    Limite de concorrência AIMD (aumento aditivo, redução multiplicativa).
+
+    O limite cresce devagar a cada sucesso e cai pela metade em falhas ou quando a
+    latência MÉDIA (EWMA) passa de `latency_target`. Uma resposta lenta isolada não
+    derruba o limite, e reduções seguidas respeitam `cooldown` segundos, para que uma
+    rajada de respostas da mesma janela conte como um único sinal de congestionamento.
+    A média só é considerada após `min_samples` respostas.
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=16, latency_target=7.5,
+                 ewma_alpha=0.2, cooldown=5.0, min_samples=5):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.ewma_alpha = ewma_alpha
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self._samples = 0
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._latency_ewma = None
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def latency_ewma(self):
+        return self._latency_ewma
+
+    def acquire(self, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            return True
+
+    def release(self, latency, success):
+        with self._cond:
+            self._in_flight -= 1
+            if success:
+                self._samples += 1
+                if self._latency_ewma is None:
+                    self._latency_ewma = latency
+                else:
+                    self._latency_ewma += self.ewma_alpha * (latency - self._latency_ewma)
+
+            # Latência só pesa depois de `min_samples` respostas (a média ainda não é confiável)
+            slow = self._samples >= self.min_samples and self._latency_ewma > self.latency_target
+            congested = not success or slow
+            now = time.monotonic()
+            if congested:
+                if now - self._last_decrease >= self.cooldown:
+                    self._limit = max(self.min_limit, self._limit / 2)
+                    self._last_decrease = now
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+
+class SophiaGuard:
+    """Combina circuit breaker e limitador adaptativo em torno de cada chamada HTTP."""
+
+    def __init__(self, breaker, limiter, acquire_timeout=2.0):
+        self.breaker = breaker
+        self.limiter = limiter
+        self.acquire_timeout = acquire_timeout
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Executa `fn` protegida. Exceções e respostas HTTP 5xx contam como falha.
+        Levanta SophiaUnavailable sem tocar a rede se o circuito estiver aberto
+        ou se o limite de concorrência não liberar vaga a tempo.
+        """
+        if not self.breaker.allow_request():
+            raise SophiaUnavailable("Circuito aberto")
+        if not self.limiter.acquire(self.acquire_timeout):
+            # Não é falha do SophiA: apenas devolve a vaga de teste do meio-aberto
+            self.breaker.cancel_probe()
+            raise SophiaUnavailable("Limite de concorrência atingido")
+
+        start = time.monotonic()
+        success = False
+        try:
+            resp = fn(*args, **kwargs)
+            success = getattr(resp, 'status_code', 200) < 500
+            return resp
+        finally:
+            self.limiter.release(time.monotonic() - start, success)
+            if success:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def stats(self):
+        return {
+            "circuito": self.breaker.state,
+            "limite_concorrencia": self.limiter.limit,
+            "em_andamento": self.limiter.in_flight,
+            "latencia_media_s": round(self.limiter.latency_ewma, 3) if self.limiter.latency_ewma is not None else None,
+        }
@@ -0,0 +1,227 @@
+import json
+import re
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Tabela padrão: reproduz exatamente a regra histórica de uma única unidade.
+# Ordem dos segmentos importa: o primeiro que casar vence.
+#
+# Regex do 1º ano explicado:
+# (?:^|[\s\-])  : início da string OU separador (espaço/traço) -> casa 'AI-1A' e '1A'
+# 1             : o número 1 literal
+# [\sº°\-]?     : separador opcional (ex: '1-A', '1ºA', '1A')
+# [A-Z]         : a letra da turma
+# (?![0-9])     : o próximo char NÃO é número (evita 10, 11)
+DEFAULT_ROUTING_TABLE = {
+    "campus_padrao": "principal",
+    "campi": [
+        {
+            "nome": "principal",
+            "prefixo_rota": "",
+            "colecao_padrao": "chamados",
+            "segmentos": [
+                {
+                    "nome": "infantil",
+                    "colecao": "chamados_ei",
+                    "rota": "/painel-infantil",
+                    "padroes": ["^EI", "^G"],
+                },
+                {
+                    "nome": "1anos",
+                    "colecao": "chamados_1ano",
+                    "rota": "/painel-1anos",
+                    "padroes": [r"(?:^|[\s\-])1[\sº°\-]?[A-Z](?![0-9])"],
+                },
+                {
+                    "nome": "fundamental",
+                    "colecao": "chamados_fund",
+                    "rota": "/painel-fundamental",
+                    "padroes": [".*"],
+                },
+            ],
+        }
+    ],
+}
+
+
+class RoutingError(ValueError):
+    """Tabela de roteamento inválida (detectada na carga, nunca durante uma chamada)."""
+
+
+class Segment:
+    """
+    Segmento de painel: um conjunto de padrões de turma -> uma coleção.
+
+    Com `shards`, o segmento é dividido em sub-coleções (`<colecao>_<sufixo>`),
+    cada uma com seu próprio painel (`<rota>-<sufixo>`). Turmas que não casam com
+    nenhum shard ficam na coleção do próprio segmento.
+    """
+
+    def __init__(self, spec, route_prefix=''):
+        try:
+            self.name = spec['nome']
+            self.collection = spec['colecao']
+            patterns = spec.get('padroes', [])
+            self.matchers = [re.compile(p) for p in patterns]
+        except KeyError as e:
+            raise RoutingError(f"Segmento sem o campo obrigatório {e}")
+        except re.error as e:
+            raise RoutingError(f"Padrão inválido no segmento '{spec.get('nome')}': {e}")
+
+        route = spec.get('rota')
+        self.route = f"{route_prefix}{route}" if route else None
+        self.shards = []
+        for shard in spec.get('shards', []):
+            suffix = shard.get('sufixo')
+            if not suffix:
+                raise RoutingError(f"Shard sem 'sufixo' no segmento '{self.name}'")
+            self.shards.append(Segment({
+                'nome': f"{self.name}_{suffix}",
+                'colecao': f"{self.collection}_{suffix}",
+                'rota': f"{route}-{suffix}" if route else None,
+                'padroes': shard.get('padroes', []),
+            }, route_prefix))
+
+    def matches(self, turma):
+        return any(m.search(turma) for m in self.matchers)
+
+    def resolve(self, turma):
+        for shard in self.shards:
+            if shard.matches(turma):
+                return shard.collection
+        return self.collection
+
+    def iter_panels(self):
+        if self.route:
+            yield self.name, self.route, self.collection
+        for shard in self.shards:
+            yield from shard.iter_panels()
+
+    def collections(self):
+        return [self.collection] + [s.collection for s in self.shards]
+
+
+class Campus:
+    def __init__(self, spec):
+        try:
+            self.name = spec['nome']
+        except KeyError:
+            raise RoutingError("Unidade (campus) sem 'nome'")
+        self.route_prefix = spec.get('prefixo_rota', '').rstrip('/')
+        self.default_collection = spec.get('colecao_padrao', 'chamados')
+        try:
+            self.matchers = [re.compile(p) for p in spec.get('padroes_turma', [])]
+        except re.error as e:
+            raise RoutingError(f"Padrão inválido na unidade '{self.name}': {e}")
+        self.segments = [Segment(s, self.route_prefix) for s in spec.get('segmentos', [])]
+
+    def matches(self, turma):
+        return any(m.search(turma) for m in self.matchers)
+
+    def resolve(self, turma):
+        for segment in self.segments:
+            if segment.matches(turma):
+                return segment.resolve(turma)
+        return self.default_collection
+
+
+class RoutingTable:
+    """
+    Roteamento turma -> coleção, carregado uma vez na inicialização.
+
+    Regexes são compiladas na carga e o resultado de cada turma é memorizado.
+    O universo de turmas de um ano letivo é pequeno, mas a turma chega no corpo
+    da requisição: a memória é limitada a RESOLVE_CACHE_SIZE entradas (LRU).
+    """
+
+    RESOLVE_CACHE_SIZE = 1024
+
+    def __init__(self, spec):
+        self.campi = [Campus(c) for c in spec.get('campi', [])]
+        if not self.campi:
+            raise RoutingError("Tabela de roteamento sem unidades ('campi')")
+        self._by_name = {c.name: c for c in self.campi}
+        default_name = spec.get('campus_padrao', self.campi[0].name)
+        if default_name not in self._by_name:
+            raise RoutingError(f"campus_padrao '{default_name}' não está em 'campi'")
+        self.default_campus = self._by_name[default_name]
+
+        routes = [route for _, route, _ in self.panels()]
+        duplicated = {r for r in routes if routes.count(r) > 1}
+        if duplicated:
+            raise RoutingError(f"Rotas de painel duplicadas: {sorted(duplicated)}")
+
+        self._resolve_cached = lru_cache(maxsize=self.RESOLVE_CACHE_SIZE)(self._resolve)
+
+    def campus_for(self, turma):
+        """Unidade da turma pelos `padroes_turma`; sem correspondência, a unidade padrão."""
+        for campus in self.campi:
+            if campus is not self.default_campus and campus.matches(turma):
+                return campus
+        return self.default_campus
+
+    def resolve(self, turma):
+        """Determina a coleção do Firestore para a turma."""
+        if not turma:
+            return self.default_campus.default_collection
+        return self._resolve_cached(turma.strip().upper())
+
+    def _resolve(self, turma):
+        collection = self.campus_for(turma).resolve(turma)
+        logger.info(f"--> TURMA '{turma}' roteada para '{collection}'")
+        return collection
+
+    def all_collections(self):
+        """Todas as coleções que a tabela pode produzir (sem repetição, ordem estável)."""
+        seen = []
+        for campus in self.campi:
+            candidates = [campus.default_collection]
+            for segment in campus.segments:
+                candidates.extend(segment.collections())
+            for name in candidates:
+                if name not in seen:
+                    seen.append(name)
+        return seen
+
+    def collections_for_segment(self, name):
+        """Coleções de um segmento (inclui shards), aceitando também o nome da própria coleção."""
+        result = []
+        for campus in self.campi:
+            if name == campus.default_collection:
+                result.append(name)
+            for segment in campus.segments:
+                for candidate in [segment] + segment.shards:
+                    if name in (candidate.name, candidate.collection) and candidate.collection not in result:
+                        result.append(candidate.collection)
+                        if candidate is segment:
+                            result.extend(s.collection for s in segment.shards if s.collection not in result)
+        return result
+
+    def panels(self):
+        """Lista (endpoint, rota, coleção) de cada painel a registrar."""
+        result = []
+        for campus in self.campi:
+            for name, route, collection in (p for s in campus.segments for p in s.iter_panels()):
+                endpoint = f"painel_{name}" if campus is self.default_campus else f"painel_{campus.name}_{name}"
+                result.append((re.sub(r'\W', '_', endpoint), route, collection))
+        return result
+
+
+def load_routing_table(path=None):
+    """
+    Carrega a tabela de um arquivo JSON (ROUTING_TABLE_FILE) ou usa a padrão.
+    Erros de sintaxe derrubam a inicialização: melhor falhar no deploy do que
+    gravar chamadas na coleção errada.
+    """
+    if not path:
+        return RoutingTable(DEFAULT_ROUTING_TABLE)
+    try:
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise RoutingError(f"Falha ao ler tabela de roteamento '{path}': {e}")
+    table = RoutingTable(spec)
+    logger.info(f"Tabela de roteamento carregada de '{path}': {len(table.campi)} unidade(s), coleções={table.all_collections()}")
+    return table
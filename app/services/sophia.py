@@ -6,13 +6,181 @@ import requests
 import concurrent.futures
 import logging
 from datetime import datetime
-from flask import current_app
+from flask import current_app, g, has_app_context, has_request_context
 from firebase_admin import firestore
+from app.services import profiling, cache
+from app.services.resilience import SophiaGuard, CircuitBreaker, AdaptiveLimiter, SophiaUnavailable
 
 # Configura Logger
 logger = logging.getLogger(__name__)
 token_lock = threading.Lock()
 
+# --- RESILIÊNCIA (Circuit Breaker + Limite Adaptativo) ---
+# Um único guard por processo: todas as threads do gunicorn compartilham o mesmo
+# estado do circuito, então quando o SophiA cai ninguém mais espera 15s.
+_guard = None
+_guard_lock = threading.Lock()
+
+# Timeout da busca por nome (a chamada mais lenta do SophiA). O alvo de latência do
+# limitador deriva dele: só consideramos o SophiA congestionado quando a média
+# se aproxima do ponto em que as buscas começariam a estourar o timeout.
+SEARCH_TIMEOUT = 15
+
+def get_guard():
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                cfg = current_app.config if has_app_context() else {}
+                _guard = SophiaGuard(
+                    CircuitBreaker(
+                        failure_threshold=cfg.get('SOPHIA_CB_FAILURE_THRESHOLD', 5),
+                        reset_timeout=cfg.get('SOPHIA_CB_RESET_SECONDS', 30),
+                    ),
+                    AdaptiveLimiter(
+                        initial=cfg.get('SOPHIA_MAX_CONCURRENCY', 16) // 2 or 1,
+                        max_limit=cfg.get('SOPHIA_MAX_CONCURRENCY', 16),
+                        latency_target=cfg.get('SOPHIA_LATENCY_TARGET') or SEARCH_TIMEOUT / 2,
+                    ),
+                    acquire_timeout=cfg.get('SOPHIA_ACQUIRE_TIMEOUT', 2.0),
+                )
+    return _guard
+
+def _sophia_request(method, url, **kwargs):
+    """Toda chamada HTTP ao SophiA passa por aqui. 5xx vira exceção."""
+    with profiling.sophia_call():
+        resp = get_guard().call(requests.request, method, url, **kwargs)
+    if resp.status_code >= 500:
+        raise requests.HTTPError(f"SophiA respondeu {resp.status_code}", response=resp)
+    if resp.status_code == 401:
+        token = (kwargs.get('headers') or {}).get('token')
+        if token:
+            invalidate_sophia_token(token)
+    return resp
+
+# --- OPERAÇÕES CACHEÁVEIS (ver app/services/cache.py) ---
+# Token: evita ler o Firestore a cada chamada; o documento continua sendo a fonte
+# compartilhada entre instâncias. Fotos mudam raramente: TTL longo.
+_token_cache = cache.namespace('sophia_token', default_timeout=25 * 60)
+_search_cache = cache.namespace('busca', default_timeout=60)
+_code_cache = cache.namespace('codigo', default_timeout=5 * 60)
+_responsibles_cache = cache.namespace('responsaveis', default_timeout=10 * 60)
+_student_photo_cache = cache.namespace('foto_aluno', default_timeout=12 * 60 * 60)
+_responsible_photo_cache = cache.namespace('foto_responsavel', default_timeout=12 * 60 * 60)
+
+# --- ÚLTIMO DADO BOM (Stale-While-Revalidate) ---
+# Guarda o último resultado bem-sucedido de buscas, códigos e responsáveis.
+# Com o SophiA fora, servimos esse dado marcado como desatualizado e
+# agendamos a atualização em background para quando o circuito fechar.
+_last_good = cache.namespace('sophia_ultimo_bom', default_timeout=24 * 60 * 60)
+_pending_refresh = {}
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+
+def _mark_stale():
+    if has_request_context():
+        g.sophia_stale = True
+
+def _serve_with_fallback(key, live_fn, *args, default=None, fresh=None):
+    """
+    Serve do cache `fresh` (single-flight: buscas idênticas simultâneas viram uma só
+    chamada ao SophiA); em falha, cai para o último dado bom marcado como desatualizado.
+    """
+    def compute():
+        result = live_fn(*args)
+        if result is not None:
+            _last_good.set(key, result)
+        return result
+
+    try:
+        return fresh.get_or_set(key, compute) if fresh else compute()
+    except Exception as e:
+        if not isinstance(e, SophiaUnavailable):
+            logger.error(f"Erro Sophia ({key[0]}): {e}")
+        cached = _last_good.get(key)
+        if cached is None:
+            return default
+        logger.warning(f"SophiA indisponível ({e}). Servindo cache desatualizado para {key[0]}.")
+        _mark_stale()
+        _schedule_refresh(key, live_fn, args, fresh)
+        return cached
+
+# Revalidação em background: backoff exponencial por chave e desistência após
+# REFRESH_MAX_ATTEMPTS tentativas (ou quando o último dado bom expira). Evita
+# martelar o SophiA/Firestore quando o erro é persistente (ex: 401 na autenticação,
+# que não abre o circuito por não ser 5xx).
+REFRESH_MAX_ATTEMPTS = 6
+REFRESH_BASE_DELAY = 2
+REFRESH_MAX_DELAY = 300
+
+class _PendingRefresh:
+    def __init__(self, live_fn, args, fresh):
+        self.live_fn = live_fn
+        self.args = args
+        self.fresh = fresh
+        self.attempts = 0
+        self.next_at = time.monotonic()
+
+def _schedule_refresh(key, live_fn, args, fresh=None):
+    global _refresh_thread
+    app = current_app._get_current_object()
+    with _refresh_lock:
+        # Já pendente: mantém tentativas/backoff em vez de recomeçar do zero
+        if key not in _pending_refresh:
+            _pending_refresh[key] = _PendingRefresh(live_fn, args, fresh)
+        if _refresh_thread is None or not _refresh_thread.is_alive():
+            _refresh_thread = threading.Thread(target=_refresh_worker, args=(app,), daemon=True)
+            _refresh_thread.start()
+
+def _refresh_worker(app):
+    """Revalida as chaves pendentes assim que o circuito permitir."""
+    while True:
+        with _refresh_lock:
+            if not _pending_refresh:
+                return
+            key, entry = min(_pending_refresh.items(), key=lambda item: item[1].next_at)
+
+        wait = entry.next_at - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, 5))
+            continue
+
+        if get_guard().breaker.state == CircuitBreaker.OPEN:
+            # Sem I/O enquanto o circuito está aberto; não conta como tentativa
+            time.sleep(1)
+            continue
+
+        if _last_good.get(key) is None:
+            logger.info(f"Revalidação descartada ({key[0]}): último dado bom expirou.")
+            _drop_refresh(key, entry)
+            continue
+
+        entry.attempts += 1
+        with app.app_context():
+            try:
+                result = entry.live_fn(*entry.args)
+                if result is not None:
+                    _last_good.set(key, result)
+                if entry.fresh is not None:
+                    entry.fresh.set(key, result)
+            except (SophiaUnavailable, requests.RequestException) as e:
+                if entry.attempts >= REFRESH_MAX_ATTEMPTS:
+                    logger.warning(f"Revalidação descartada ({key[0]}) após {entry.attempts} tentativas: {e}")
+                    _drop_refresh(key, entry)
+                else:
+                    delay = min(REFRESH_MAX_DELAY, REFRESH_BASE_DELAY * 2 ** (entry.attempts - 1))
+                    entry.next_at = time.monotonic() + delay
+                continue
+            except Exception as e:
+                logger.error(f"Revalidação descartada ({key[0]}): {e}")
+
+        _drop_refresh(key, entry)
+
+def _drop_refresh(key, entry):
+    with _refresh_lock:
+        if _pending_refresh.get(key) is entry:
+            del _pending_refresh[key]
+
 def normalize_text(text):
     if not text: return ""
     nfkd_form = unicodedata.normalize('NFKD', str(text).lower())
@@ -27,16 +195,28 @@ def get_db():
         return None
 
 def get_sophia_token():
+    cached = _token_cache.get('token')
+    if cached: return cached
+
     with token_lock:
+        # Outra thread pode ter renovado enquanto esperávamos o lock
+        cached = _token_cache.get('token')
+        if cached: return cached
+
         db = get_db()
         if not db: return None
 
         doc_ref = db.collection('system_config').document('sophia_token')
         try:
             doc = doc_ref.get()
+            profiling.count('firestore_reads')
             if doc.exists:
                 data = doc.to_dict()
-                if time.time() < data.get('expires_at', 0) - 30:
+                remaining = data.get('expires_at', 0) - 30 - time.time()
+                # timeout 0 no cachelib significa "nunca expira": abaixo de 1s não cacheia
+                if remaining >= 1:
+                    _token_cache.set('token', data.get('token'), timeout=int(remaining))
+                if remaining > 0:
                     return data.get('token')
         except Exception:
             pass
@@ -50,7 +230,7 @@ def get_sophia_token():
                 "usuario": current_app.config['SOPHIA_USER'],
                 "senha": current_app.config['SOPHIA_PASSWORD']
             }
-            resp = requests.post(auth_url, json=payload, timeout=10)
+            resp = _sophia_request('POST', auth_url, json=payload, timeout=10)
             resp.raise_for_status()
             
             new_token = resp.text.strip()
@@ -59,22 +239,75 @@ def get_sophia_token():
                 'expires_at': time.time() + (29 * 60),
                 'updated_at': firestore.SERVER_TIMESTAMP
             })
+            profiling.count('firestore_writes')
+            _token_cache.set('token', new_token, timeout=29 * 60 - 30)
             return new_token
         except Exception as e:
             logger.error(f"Erro Auth Sophia: {e}")
             return None
 
+def invalidate_sophia_token(token):
+    """
+    SophiA recusou o token (401): descarta do cache e marca o documento como expirado,
+    para que a próxima chamada autentique de novo em vez de repetir o token inválido.
+    """
+    _token_cache.delete('token')
+    db = get_db()
+    if not db: return
+    doc_ref = db.collection('system_config').document('sophia_token')
+    try:
+        doc = doc_ref.get()
+        profiling.count('firestore_reads')
+        # Outro worker pode já ter gravado um token novo: só expira se for o mesmo
+        if doc.exists and doc.to_dict().get('token') == token:
+            doc_ref.update({'expires_at': 0})
+            profiling.count('firestore_writes')
+            logger.warning("Token SophiA recusado (401): será renovado na próxima chamada.")
+    except Exception as e:
+        logger.error(f"Erro ao invalidar token Sophia: {e}")
+
 def fetch_photo(aluno_id, headers, base_url):
+    cached = _student_photo_cache.get(aluno_id)
+    if cached: return aluno_id, cached
     try:
         url = f"{base_url}/api/v1/alunos/{aluno_id}/Fotos/FotosReduzida"
-        resp = requests.get(url, headers=headers, timeout=5)
+        resp = _sophia_request('GET', url, headers=headers, timeout=5)
         if resp.status_code == 200 and resp.text:
             data = resp.json()
-            return aluno_id, data.get('foto')
-    except:
+            foto = data.get('foto')
+            if foto: _student_photo_cache.set(aluno_id, foto)
+            return aluno_id, foto
+    except Exception:
         pass
     return aluno_id, None
 
+def _attach_photos(alunos, photo_key='id'):
+    """
+    Preenche `fotoUrl` a partir do cache de fotos, buscando no SophiA só as que faltam.
+    Fica fora do resultado cacheado/último dado bom: uma foto que falhou (ex: limitador
+    sem vaga no pico) é tentada de novo na próxima busca em vez de ficar 24h sem foto.
+    `photo_key` é o campo usado como ID na URL da foto (a busca usa a matrícula).
+    """
+    alunos = [dict(a) for a in alunos]
+    missing = {a[photo_key]: a for a in alunos if not a.get('fotoUrl')}
+    if not missing:
+        return alunos
+    token = get_sophia_token()
+    if not token:
+        return alunos
+    base_url = current_app.config.get('SOPHIA_BASE_URL')
+    headers = {'token': token, 'Accept': 'application/json'}
+
+    if len(missing) == 1:
+        results = [fetch_photo(next(iter(missing)), headers, base_url)]
+    else:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = [executor.submit(profiling.bind_to_request(fetch_photo), aid, headers, base_url) for aid in missing]
+            results = [f.result() for f in concurrent.futures.as_completed(futures)]
+    for aid, foto in results:
+        if foto: missing[aid]['fotoUrl'] = foto
+    return alunos
+
 def select_official_class(turmas_raw, ignore_prefix='EM'):
     if not turmas_raw: return None
     blacklist = ['FUTSAL', 'BASQUETE', 'VOLEI', 'HANDEBOL', 'XADREZ', 'JUDO', 'KARATE', 'JIU', 'BALLET', 'JAZZ', 'SAPATEADO', 'TEATRO', 'ROBOTICA', 'INFORMATICA', 'MAKER', 'DANCA', 'CORAL', 'MUSICA', 'VIOLAO', 'TECLADO', 'TREINAMENTO', 'APROFUNDAMENTO', 'MODALIDADE', 'SELECAO', 'MISTO', 'ALMOCO', 'PERIODO', 'EXTRA', 'INTEGRAL', 'CURSO', 'CIRCULO', 'OPCIONAL']
@@ -99,21 +332,22 @@ def select_official_class(turmas_raw, ignore_prefix='EM'):
     return melhor_turma
 
 def search_students(parte_nome, grupo_filtro):
+    key = ('busca', normalize_text(parte_nome).upper(), grupo_filtro)
+    alunos = _serve_with_fallback(key, _search_students_live, parte_nome, grupo_filtro, default=[], fresh=_search_cache)
+    return _attach_photos(alunos, photo_key='matricula')
+
+def _search_students_live(parte_nome, grupo_filtro):
     token = get_sophia_token()
-    if not token: return []
+    if not token: raise SophiaUnavailable("Sem token SophiA")
     base_url = current_app.config.get('SOPHIA_BASE_URL')
     headers = {'token': token, 'Accept': 'application/json'}
     ano_atual = datetime.now().year
     params = {"Nome": parte_nome, "AnoLetivo": str(ano_atual), "StatusMatricula": "Matriculado"}
     prefixo_ignorado = current_app.config.get('IGNORE_CLASS_PREFIX', 'EM').upper()
 
-    try:
-        resp = requests.get(f"{base_url}/api/v1/alunos", headers=headers, params=params, timeout=15)
-        resp.raise_for_status()
-        raw_students = resp.json()
-    except Exception as e:
-        logger.error(f"Erro Sophia: {e}")
-        return []
+    resp = _sophia_request('GET', f"{base_url}/api/v1/alunos", headers=headers, params=params, timeout=SEARCH_TIMEOUT)
+    resp.raise_for_status()
+    raw_students = resp.json()
 
     termos_busca = normalize_text(parte_nome).upper().split()
     alunos_filtrados = {}
@@ -138,29 +372,28 @@ def search_students(parte_nome, grupo_filtro):
                 "fotoUrl": None
             }
 
-    if alunos_filtrados:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {executor.submit(fetch_photo, aid, headers, base_url): aid for aid in alunos_filtrados}
-            for future in concurrent.futures.as_completed(futures):
-                aid, foto = future.result()
-                if foto: alunos_filtrados[aid]['fotoUrl'] = foto
-
+    # Fotos são anexadas em search_students (fora do cache)
     return list(alunos_filtrados.values())
 
 def get_student_by_code(student_code):
+    key = ('codigo', str(student_code))
+    aluno = _serve_with_fallback(key, _get_student_by_code_live, student_code, fresh=_code_cache)
+    return _attach_photos([aluno])[0] if aluno else aluno
+
+def _get_student_by_code_live(student_code):
     token = get_sophia_token()
-    if not token: return None
+    if not token: raise SophiaUnavailable("Sem token SophiA")
     base_url = current_app.config.get('SOPHIA_BASE_URL')
     headers = {'token': token, 'Accept': 'application/json'}
     prefixo_ignorado = current_app.config.get('IGNORE_CLASS_PREFIX', 'EM').upper()
     ano_atual = datetime.now().year
-    try:
-        url = f"{base_url}/api/v1/alunos"
-        params = {'Codigo': student_code, 'AnoLetivo': str(ano_atual)}
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
-        if resp.status_code != 200: return None
-        lista_alunos = resp.json()
-    except Exception: return None
+    url = f"{base_url}/api/v1/alunos"
+    params = {'Codigo': student_code, 'AnoLetivo': str(ano_atual)}
+    resp = _sophia_request('GET', url, headers=headers, params=params, timeout=10)
+    # Só 404 é "não encontrado" (cacheável); 401/403/429 etc. sobem para o fallback
+    if resp.status_code == 404: return None
+    resp.raise_for_status()
+    lista_alunos = resp.json()
 
     aluno_encontrado = None
     if isinstance(lista_alunos, list):
@@ -183,10 +416,6 @@ def get_student_by_code(student_code):
         "turma": turma_oficial,
         "fotoUrl": None
     }
-    try:
-        _, foto_base64 = fetch_photo(student_data["id"], headers, base_url)
-        if foto_base64: student_data["fotoUrl"] = foto_base64
-    except Exception: pass
     return student_data
 
 # --- FUNÇÕES DE RESPONSÁVEIS (CORRIGIDAS) ---
@@ -196,8 +425,12 @@ def get_student_responsibles(student_id):
     Busca responsáveis filtrando o próprio aluno e recuperando o ID correto para a foto.
     AGORA ACEITA 'CODIGO' COMO ID SE 'ID' ESTIVER AUSENTE.
     """
+    key = ('responsaveis', str(student_id))
+    return _serve_with_fallback(key, _get_student_responsibles_live, student_id, default=[], fresh=_responsibles_cache)
+
+def _get_student_responsibles_live(student_id):
     token = get_sophia_token()
-    if not token: return []
+    if not token: raise SophiaUnavailable("Sem token SophiA")
 
     base_url = current_app.config.get('SOPHIA_BASE_URL')
     headers = {'token': token, 'Accept': 'application/json'}
@@ -206,71 +439,67 @@ def get_student_responsibles(student_id):
     nome_aluno_norm = ""
     try:
         url_aluno = f"{base_url}/api/v1/Alunos/{student_id}"
-        resp_aluno = requests.get(url_aluno, headers=headers, timeout=5)
+        resp_aluno = _sophia_request('GET', url_aluno, headers=headers, timeout=5)
         if resp_aluno.status_code == 200:
             dados_aluno = resp_aluno.json()
             nome_aluno_norm = normalize_text(dados_aluno.get('nome'))
     except Exception: pass
 
-    # 2. Busca lista de responsáveis
-    try:
-        url = f"{base_url}/api/v1/alunos/{student_id}/responsaveis"
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code != 200: return []
-            
-        raw_data = resp.json()
-        clean_list = []
-        
-        for item in raw_data:
-            raw_name = item.get('nome')
-            pessoa_data = item.get('pessoa')
-            if pessoa_data and isinstance(pessoa_data, dict):
-                raw_name = pessoa_data.get('nome') or raw_name
-            
-            nome_resp_norm = normalize_text(raw_name)
-            
-            # Filtra o próprio aluno
-            if nome_aluno_norm and nome_aluno_norm == nome_resp_norm: continue
+    # 2. Busca lista de responsáveis (falhas de rede sobem para o fallback)
+    url = f"{base_url}/api/v1/alunos/{student_id}/responsaveis"
+    resp = _sophia_request('GET', url, headers=headers, timeout=10)
+    if resp.status_code == 404: return []
+    resp.raise_for_status()
 
-            # LÓGICA DE RECUPERAÇÃO DE ID (CRUCIAL)
-            # Ordem de prioridade: item['id'] -> pessoa['id'] -> item['codigo']
-            resp_id = None
-            
-            # 1. Tenta ID direto
-            if item.get('id'):
-                resp_id = str(item.get('id'))
-            
-            # 2. Tenta ID da Pessoa (se o anterior for None)
-            if not resp_id and item.get('pessoa', {}).get('id'):
-                resp_id = str(item.get('pessoa').get('id'))
-                
-            # 3. Tenta CODIGO (conforme visto nos logs)
-            if not resp_id and item.get('codigo'):
-                resp_id = str(item.get('codigo'))
-                
-            # Se ainda for None, não temos como identificar
-            if not resp_id:
-                logger.warning(f"Responsável ignorado (sem ID/Código): {raw_name}")
-                continue
+    raw_data = resp.json()
+    clean_list = []
 
-            # Tratamento do Vínculo
-            vinculo_data = item.get('tipoVinculo')
-            if vinculo_data and isinstance(vinculo_data, dict):
-                vinculo_desc = vinculo_data.get('descricao', 'Outros')
-            else:
-                vinculo_desc = 'Outros'
-            
-            clean_list.append({
-                "id": resp_id,
-                "nome": raw_name, 
-                "vinculo": vinculo_desc
-            })
-            
-        return clean_list
+    for item in raw_data:
+        raw_name = item.get('nome')
+        pessoa_data = item.get('pessoa')
+        if pessoa_data and isinstance(pessoa_data, dict):
+            raw_name = pessoa_data.get('nome') or raw_name
 
-    except Exception as e:
-        logger.error(f"Exceção responsaveis: {e}")
-        return []
+        nome_resp_norm = normalize_text(raw_name)
+
+        # Filtra o próprio aluno
+        if nome_aluno_norm and nome_aluno_norm == nome_resp_norm: continue
+
+        # LÓGICA DE RECUPERAÇÃO DE ID (CRUCIAL)
+        # Ordem de prioridade: item['id'] -> pessoa['id'] -> item['codigo']
+        resp_id = None
+
+        # 1. Tenta ID direto
+        if item.get('id'):
+            resp_id = str(item.get('id'))
+
+        # 2. Tenta ID da Pessoa (se o anterior for None)
+        if not resp_id and item.get('pessoa', {}).get('id'):
+            resp_id = str(item.get('pessoa').get('id'))
+
+        # 3. Tenta CODIGO (conforme visto nos logs)
+        if not resp_id and item.get('codigo'):
+            resp_id = str(item.get('codigo'))
+
+        # Se ainda for None, não temos como identificar
+        if not resp_id:
+            logger.warning(f"Responsável ignorado (sem ID/Código): {raw_name}")
+            continue
+
+        # Tratamento do Vínculo
+        vinculo_data = item.get('tipoVinculo')
+        if vinculo_data and isinstance(vinculo_data, dict):
+            vinculo_desc = vinculo_data.get('descricao', 'Outros')
+        else:
+            vinculo_desc = 'Outros'
+
+        clean_list.append({
+            "id": resp_id,
+            "nome": raw_name, 
+            "vinculo": vinculo_desc
+        })
+
+    return clean_list
 
 def get_responsible_photo_base64(responsible_id):
     """
@@ -278,6 +507,15 @@ def get_responsible_photo_base64(responsible_id):
     1. Tenta endpoint de /responsaveis
     2. Se falhar, tenta endpoint de /pessoas
     """
+    cached = _responsible_photo_cache.get(responsible_id)
+    if cached: return cached
+
+    # Só cacheia foto encontrada: uma falha do SophiA não pode virar "sem foto" por 12h
+    foto = _get_responsible_photo_live(responsible_id)
+    if foto: _responsible_photo_cache.set(responsible_id, foto)
+    return foto
+
+def _get_responsible_photo_live(responsible_id):
     token = get_sophia_token()
     if not token: return None
 
@@ -287,7 +525,7 @@ def get_responsible_photo_base64(responsible_id):
     # TENTATIVA 1: Endpoint de Vínculo/Responsável
     try:
         url = f"{base_url}/api/v1/responsaveis/{responsible_id}/fotos/FotoReduzida"
-        resp = requests.get(url, headers=headers, timeout=4)
+        resp = _sophia_request('GET', url, headers=headers, timeout=4)
         if resp.status_code == 200:
             data = resp.json()
             if data and 'foto' in data: return data.get('foto')
@@ -296,7 +534,7 @@ def get_responsible_photo_base64(responsible_id):
     # TENTATIVA 2: Endpoint de Pessoa (Fallback)
     try:
         url_pessoa = f"{base_url}/api/v1/pessoas/{responsible_id}/fotos/FotoReduzida"
-        resp = requests.get(url_pessoa, headers=headers, timeout=4)
+        resp = _sophia_request('GET', url_pessoa, headers=headers, timeout=4)
         if resp.status_code == 200:
             data = resp.json()
             if data and 'foto' in data: return data.get('foto')
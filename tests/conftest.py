@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+from cachelib import SimpleCache
+from flask import Flask
+
+# Permite `import app` rodando `python -m pytest` da raiz do projeto
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import cache  # noqa: E402
+
+
+@pytest.fixture
+def fresh_cache():
+    """Cache em memória vazio para o teste (os namespaces dos serviços são globais)."""
+    previous = cache._backend, cache._shared_backend
+    cache._backend, cache._shared_backend = SimpleCache(threshold=500), False
+    yield cache._backend
+    cache._backend, cache._shared_backend = previous
+
+
+@pytest.fixture
+def flask_app(fresh_cache):
+    """App Flask mínimo (sem Firebase/OAuth) para serviços que leem `current_app`."""
+    app = Flask('teste')
+    app.config.update(SOPHIA_BASE_URL='http://sophia.test', SOPHIA_USER='u', SOPHIA_PASSWORD='p')
+    app.db = None
+    with app.app_context():
+        yield app
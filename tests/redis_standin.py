@@ -0,0 +1,95 @@
+import time
+import fnmatch
+import threading
+from collections import OrderedDict
+
+
+class RedisStandIn:
+    """
+    Cliente Redis em memória com o subconjunto de comandos que o RedisCache do
+    cachelib usa (get/set/setex/setnx/expire/delete/exists/keys/mget/incr/flushdb).
+
+    Respeita TTL e, com `max_keys`, descarta a chave menos usada recentemente
+    (equivalente a `maxmemory-policy allkeys-lru`). Compartilhar a mesma instância
+    entre dois backends simula dois workers apontando para o mesmo Redis.
+    """
+
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys
+        self._data = OrderedDict()  # chave -> (valor, expira_em | None)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def _alive(self, name):
+        entry = self._data.get(name)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[name]
+            return None
+        self._data.move_to_end(name)
+        return entry
+
+    def _store(self, name, value, ttl=None):
+        self._data[name] = (self._encode(value), time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(name)
+        while self.max_keys is not None and len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    def get(self, name):
+        with self._lock:
+            entry = self._alive(name)
+            return entry[0] if entry else None
+
+    def mget(self, keys):
+        return [self.get(k) for k in keys]
+
+    def set(self, name, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._alive(name):
+                return None
+            self._store(name, value, ex)
+            return True
+
+    def setex(self, name, time, value):
+        return self.set(name, value, ex=time)
+
+    def setnx(self, name, value):
+        return bool(self.set(name, value, nx=True))
+
+    def expire(self, name, time):
+        with self._lock:
+            entry = self._alive(name)
+            if entry is None:
+                return False
+            self._store(name, entry[0], time)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for n in names if self._data.pop(n, None) is not None)
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for n in names if self._alive(n))
+
+    def keys(self, pattern='*'):
+        with self._lock:
+            return [k.encode('utf-8') for k in list(self._data) if self._alive(k) and fnmatch.fnmatchcase(k, pattern)]
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            entry = self._alive(name)
+            value = int(entry[0]) + amount if entry else amount
+            self._store(name, value, None)
+            return value
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            return True
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+from firebase_admin import firestore as fs
+
+from app.services import firestore
+
+
+def test_first_call_counts_distinct_student():
+    assert firestore._recall_counters(None, 1000) == {"alunos_distintos": fs.Increment(1)}
+
+
+def test_recall_adds_wait_since_previous_call():
+    assert firestore._recall_counters({"ultima_chamada": 1000, "chamadas": 1}, 1300.7) == {
+        "rechamadas": fs.Increment(1),
+        "espera_total_seg": fs.Increment(300),
+    }
+
+
+def test_recall_never_adds_negative_wait():
+    # Relógios de instâncias diferentes podem divergir alguns segundos
+    assert firestore._recall_counters({"ultima_chamada": 1005}, 1000)["espera_total_seg"] == fs.Increment(0)
+
+
+def test_student_doc_without_last_call_adds_nothing():
+    assert firestore._recall_counters({}, 1000) == {}
+
+
+def test_local_now_uses_configured_timezone(flask_app):
+    flask_app.config['TIMEZONE'] = 'America/Sao_Paulo'
+    assert firestore.local_now().utcoffset() == timedelta(hours=-3)
+    flask_app.config['TIMEZONE'] = 'UTC'
+    assert firestore.local_now().utcoffset() == timedelta(0)
+
+
+def test_day_and_hour_buckets_are_local(flask_app, monkeypatch):
+    # 17:30 em São Paulo = 20:30 UTC
+    now = datetime(2024, 3, 15, 17, 30, tzinfo=ZoneInfo('America/Sao_Paulo'))
+    monkeypatch.setattr(firestore, 'local_now', lambda: now)
+    update = mock.Mock(return_value={"rechamadas": fs.Increment(1)})
+    monkeypatch.setattr(firestore, '_update_student_analytics', update)
+    db = mock.Mock()
+
+    firestore._record_call_analytics(db, 'chamados_fund', {'id': '42', 'turma': ' ai-5a '})
+
+    db.collection.assert_called_with(firestore.ANALYTICS_COLLECTION)
+    db.collection.return_value.document.assert_called_with('2024-03-15')
+    day_ref = db.collection.return_value.document.return_value
+    update.assert_called_once_with(db.transaction.return_value, day_ref.collection.return_value.document.return_value, now.timestamp())
+
+    # Documento do dia gravado fora da transação, com os contadores do aluno incluídos
+    counters, = day_ref.set.call_args.args
+    assert day_ref.set.call_args.kwargs == {'merge': True}
+    assert counters['por_hora'] == {'17': fs.Increment(1)}
+    assert counters['por_turma'] == {'AI-5A': fs.Increment(1)}
+    assert counters['rechamadas'] == fs.Increment(1)
+
+
+def test_call_without_student_id_skips_transaction(flask_app, monkeypatch):
+    monkeypatch.setattr(firestore, '_update_student_analytics', mock.Mock(side_effect=AssertionError))
+    db = mock.Mock()
+
+    firestore._record_call_analytics(db, 'chamados_ei', {'turma': 'EI-A'})
+
+    db.transaction.assert_not_called()
+    counters, = db.collection.return_value.document.return_value.set.call_args.args
+    assert 'alunos_distintos' not in counters
+
+
+def test_transaction_only_touches_student_doc():
+    transaction = mock.Mock()
+    aluno_ref = mock.Mock()
+    aluno_ref.get.return_value = mock.Mock(exists=True, to_dict=lambda: {"ultima_chamada": 1000})
+
+    # `to_wrap` é a função sem o retry do @firestore.transactional
+    extra = firestore._update_student_analytics.to_wrap(transaction, aluno_ref, 1060)
+
+    aluno_ref.get.assert_called_once_with(transaction=transaction)
+    transaction.set.assert_called_once_with(
+        aluno_ref, {"ultima_chamada": 1060, "chamadas": fs.Increment(1)}, merge=True)
+    assert extra == {"rechamadas": fs.Increment(1), "espera_total_seg": fs.Increment(60)}
@@ -0,0 +1,191 @@
+import sys
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+from cachelib import SimpleCache, FileSystemCache, RedisCache
+
+from app.services import cache
+from redis_standin import RedisStandIn
+
+THRESHOLD = 5
+
+
+@pytest.fixture(params=['memory', 'filesystem', 'redis'])
+def backend(request, tmp_path):
+    """Inicializa o cache do módulo com cada CACHE_TYPE e restaura o anterior no fim."""
+    previous = cache._backend, cache._shared_backend
+    config = {'CACHE_TYPE': request.param, 'CACHE_DIR': str(tmp_path), 'CACHE_THRESHOLD': THRESHOLD}
+    redis_client = RedisStandIn(max_keys=THRESHOLD) if request.param == 'redis' else None
+    cache.init_app(SimpleNamespace(config=config), redis_client=redis_client)
+    yield request.param
+    cache._backend, cache._shared_backend = previous
+
+
+@pytest.fixture
+def shared_backend(backend):
+    if backend == 'memory':
+        pytest.skip("lock no backend só existe em cache compartilhado")
+    return backend
+
+
+def _boom():
+    raise RuntimeError("SophiA fora")
+
+
+def _run_concurrently(n, fn):
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def worker(i):
+        barrier.wait()
+        results[i] = fn()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_backend_type(backend):
+    expected = {'memory': SimpleCache, 'filesystem': FileSystemCache, 'redis': RedisCache}[backend]
+    assert isinstance(cache._backend, expected)
+    assert cache._shared_backend == (backend != 'memory')
+
+
+def test_get_or_set_single_flight(backend):
+    ns = cache.CacheNamespace('teste_single_flight', default_timeout=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return ['aluno']
+
+    results = _run_concurrently(8, lambda: ns.get_or_set('maria', compute))
+
+    assert results == [['aluno']] * 8
+    assert len(calls) == 1
+    stats = ns.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] + stats['coalesced'] == 7
+    assert stats['sets'] == 1
+    assert stats['hit_ratio'] == 0.875
+
+
+def test_waiters_share_the_owner_failure(backend):
+    ns = cache.CacheNamespace('teste_falha_compartilhada', default_timeout=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.3)
+        raise RuntimeError("SophiA fora")
+
+    def call():
+        start = time.monotonic()
+        try:
+            ns.get_or_set('maria', compute)
+        except RuntimeError:
+            return time.monotonic() - start
+
+    elapsed = _run_concurrently(6, call)
+
+    # Todos falham junto com o dono, sem recalcular em fila (0.3/0.6/0.9...)
+    assert len(calls) == 1
+    assert max(elapsed) < 0.5
+    assert ns.stats()['shared_errors'] == 5
+
+
+def test_waiter_computes_when_local_owner_stalls(backend):
+    ns = cache.CacheNamespace('teste_dono_local_travado', default_timeout=60, lock_timeout=0.2)
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        time.sleep(1)
+        return 'lento'
+
+    owner = threading.Thread(target=ns.get_or_set, args=('chave', slow))
+    owner.start()
+    started.wait()
+
+    start = time.monotonic()
+    # Com backend compartilhado ainda há o polling do lock do backend: até 2x lock_timeout
+    assert ns.get_or_set('chave', lambda: 'rapido') == 'rapido'
+    assert time.monotonic() - start < 0.8
+    owner.join()
+
+
+def test_none_is_cached_and_errors_are_not(backend):
+    ns = cache.CacheNamespace('teste_none', default_timeout=60)
+    assert ns.get_or_set('nao_existe', lambda: None) is None
+    assert ns.get_or_set('nao_existe', lambda: pytest.fail("None deveria estar em cache")) is None
+    with pytest.raises(RuntimeError):
+        ns.get_or_set('falha', _boom)
+    assert ns.get_or_set('falha', lambda: 'ok') == 'ok'
+    assert ns.stats()['hits'] == 1
+
+
+def test_waits_for_lock_held_by_another_worker(shared_backend):
+    ns = cache.CacheNamespace('teste_outro_worker', default_timeout=60, lock_timeout=5)
+    # Outro worker já está calculando a chave: segura o lock e grava o valor depois
+    assert cache._backend.add('__lock__:teste_outro_worker:chave', 1, timeout=5)
+    threading.Timer(0.2, ns.set, args=('chave', 'do outro worker')).start()
+
+    value = ns.get_or_set('chave', lambda: pytest.fail("não deveria recalcular"))
+
+    assert value == 'do outro worker'
+    assert ns.stats()['coalesced'] == 1
+
+
+def test_computes_when_lock_owner_stalls(shared_backend):
+    ns = cache.CacheNamespace('teste_dono_travado', default_timeout=60, lock_timeout=0.3)
+    cache._backend.add('__lock__:teste_dono_travado:chave', 1, timeout=5)
+
+    start = time.monotonic()
+    assert ns.get_or_set('chave', lambda: 'calculado') == 'calculado'
+    assert time.monotonic() - start >= 0.3
+    assert ns.stats()['misses'] == 1
+
+
+def test_lock_is_released_after_compute(shared_backend):
+    ns = cache.CacheNamespace('teste_libera_lock', default_timeout=60)
+    with pytest.raises(RuntimeError):
+        ns.get_or_set('chave', _boom)
+    assert not cache._backend.has('__lock__:teste_libera_lock:chave')
+
+
+def test_eviction_respects_threshold(backend):
+    ns = cache.CacheNamespace('teste_eviction', default_timeout=60)
+    for i in range(4 * THRESHOLD):
+        ns.set(i, f"valor {i}")
+
+    remaining = [i for i in range(4 * THRESHOLD) if ns.get(i) is not None]
+    # SimpleCache/FileSystemCache podam antes de gravar: até threshold + 1 chaves
+    assert len(remaining) <= THRESHOLD + 1
+    assert (4 * THRESHOLD - 1) in remaining
+
+
+def test_stats_registry(backend):
+    ns = cache.namespace('teste_registro', default_timeout=42)
+    assert cache.namespace('teste_registro') is ns
+    ns.get('x')
+    stats = cache.stats()
+    assert stats['backend'] == type(cache._backend).__name__
+    assert stats['operacoes']['teste_registro']['misses'] >= 1
+    assert stats['operacoes']['teste_registro']['ttl'] == 42
+
+
+def test_unknown_cache_type_fails_startup():
+    with pytest.raises(cache.CacheConfigError):
+        cache.create_backend({'CACHE_TYPE': 'memcached'})
+
+
+def test_redis_without_package_fails_startup(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'redis', None)
+    with pytest.raises(cache.CacheConfigError):
+        cache.create_backend({'CACHE_TYPE': 'redis'})
@@ -0,0 +1,140 @@
+import csv
+import io
+from datetime import date, datetime, timezone
+
+import pytest
+
+from app.services import export
+
+
+def test_parse_range_defaults_end_to_start():
+    assert export.parse_range('2024-03-01') == (date(2024, 3, 1), date(2024, 3, 1))
+    assert export.parse_range('2024-03-01', '2024-03-31') == (date(2024, 3, 1), date(2024, 3, 31))
+
+
+@pytest.mark.parametrize('inicio, fim', [
+    (None, None),
+    ('01/03/2024', None),
+    ('2024-03-31', '2024-03-01'),
+    ('2023-01-01', '2024-12-31'),
+])
+def test_parse_range_rejects(inicio, fim):
+    with pytest.raises(ValueError):
+        export.parse_range(inicio, fim)
+
+
+def test_csv_neutralizes_formulas(monkeypatch):
+    calls = [('chamados_fund', 'doc1', {'id': '42', 'nomeCompleto': '=HYPERLINK("http://x")', 'turma': '+5A'}),
+             ('chamados_fund', 'doc2', {'id': '43', 'nomeCompleto': 'Ana -Maria', 'turma': '@1B'})]
+    monkeypatch.setattr(export.firestore, 'iter_calls', lambda *args: iter(calls))
+
+    text = ''.join(export.iter_export_lines(date(2024, 3, 1), date(2024, 3, 1), 'csv'))
+    rows = list(csv.DictReader(io.StringIO(text)))
+
+    assert rows[0]['nomeCompleto'] == '\'=HYPERLINK("http://x")'
+    assert rows[0]['turma'] == "'+5A"
+    assert rows[1]['nomeCompleto'] == 'Ana -Maria'
+    assert rows[1]['turma'] == "'@1B"
+
+
+def test_ndjson_keeps_raw_values(monkeypatch):
+    calls = [('chamados_fund', 'doc1', {'nomeCompleto': '=1+1'})]
+    monkeypatch.setattr(export.firestore, 'iter_calls', lambda *args: iter(calls))
+
+    lines = list(export.iter_export_lines(date(2024, 3, 1), date(2024, 3, 1), 'ndjson'))
+
+    assert '"nomeCompleto": "=1+1"' in lines[0]
+
+
+class _FakeDoc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _FakeQuery:
+    """Subconjunto da Query do Firestore usado por iter_calls (where/order_by/limit/start_after)."""
+
+    _OPS = {'==': lambda a, b: a == b, '>=': lambda a, b: a >= b, '<': lambda a, b: a < b}
+
+    def __init__(self, docs, log, order=None, limit=None, after=None):
+        self._docs, self._log, self._order, self._limit, self._after = docs, log, order, limit, after
+
+    def _copy(self, **changes):
+        state = dict(docs=self._docs, log=self._log, order=self._order, limit=self._limit, after=self._after)
+        state.update(changes)
+        return _FakeQuery(**state)
+
+    def where(self, field, op, value):
+        return self._copy(docs=[d for d in self._docs if field in d._data and self._OPS[op](d._data[field], value)])
+
+    def order_by(self, field):
+        return self._copy(order=field)
+
+    def limit(self, n):
+        return self._copy(limit=n)
+
+    def start_after(self, doc):
+        return self._copy(after=doc)
+
+    def _key(self, doc):
+        return doc.id if self._order == '__name__' else doc._data[self._order]
+
+    def stream(self):
+        docs = sorted(self._docs, key=self._key)
+        if self._after is not None:
+            docs = [d for d in docs if self._key(d) > self._key(self._after)]
+        self._log.append(len(docs[:self._limit]))
+        return iter(docs[:self._limit])
+
+
+class _FakeDb:
+    def __init__(self, collections):
+        self.pages = []
+        self._collections = collections
+
+    def collection(self, name):
+        return _FakeQuery(self._collections.get(name, []), self.pages)
+
+
+def _call(doc_id, student_id, ts):
+    return _FakeDoc(doc_id, {'id': student_id, 'timestamp': ts, 'nomeCompleto': f"Aluno {student_id}"})
+
+
+def test_iter_calls_pages_through_date_range(monkeypatch):
+    docs = [_call(f"d{i}", str(i % 2), datetime(2024, 3, 1 + i, 15)) for i in range(7)]
+    db = _FakeDb({'chamados_fund': docs})
+    monkeypatch.setattr(export.firestore, 'get_db', lambda: db)
+
+    got = list(export.firestore.iter_calls(date(2024, 3, 2), date(2024, 3, 6), ['chamados_fund'], page_size=2))
+
+    assert [doc_id for _, doc_id, _ in got] == ['d1', 'd2', 'd3', 'd4', 'd5']
+    # 5 documentos em páginas de 2: o cursor avança sem repetir nem pular
+    assert db.pages == [2, 2, 1]
+
+
+def test_iter_calls_student_filter_applies_dates(monkeypatch):
+    docs = [
+        _call('a1', '42', datetime(2024, 2, 28, 15, tzinfo=timezone.utc)),  # antes da faixa
+        _call('a2', '42', datetime(2024, 3, 1, 0, 0, tzinfo=timezone.utc)),
+        _call('a3', '7', datetime(2024, 3, 1, 12, tzinfo=timezone.utc)),   # outro aluno
+        _call('a4', '42', datetime(2024, 3, 2, 23, 59, tzinfo=timezone.utc)),
+        _call('a5', '42', datetime(2024, 3, 3, 0, 0, tzinfo=timezone.utc)),  # fim exclusivo
+        _call('a6', '42', None),
+    ]
+    db = _FakeDb({'chamados_ei': docs[:3], 'chamados_fund': docs[3:]})
+    monkeypatch.setattr(export.firestore, 'get_db', lambda: db)
+
+    got = list(export.firestore.iter_calls(date(2024, 3, 1), date(2024, 3, 2), ['chamados_ei', 'chamados_fund'],
+                                           student_id=42, page_size=1))
+
+    assert [(coll, doc_id) for coll, doc_id, _ in got] == [('chamados_ei', 'a2'), ('chamados_fund', 'a4')]
+
+
+def test_iter_calls_without_firestore_raises(monkeypatch):
+    monkeypatch.setattr(export.firestore, 'get_db', lambda: None)
+    with pytest.raises(RuntimeError):
+        list(export.firestore.iter_calls(date(2024, 3, 1), date(2024, 3, 1), ['chamados_fund']))
@@ -0,0 +1,71 @@
+import os
+import time
+import pstats
+import concurrent.futures
+
+import pytest
+from flask import Flask, session
+
+from app.services import profiling
+
+
+def _slow_sophia_call():
+    with profiling.sophia_call():
+        time.sleep(0.1)
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask('teste_profiling')
+    app.config.update(SECRET_KEY='teste', PROFILING_OPERATORS='op@escola.br',
+                      PROFILING_DIR=str(tmp_path), PROFILING_MAX_FILES=3)
+    profiling.init_app(app)
+
+    @app.route('/login')
+    def login():
+        session['user'] = {'email': 'op@escola.br'}
+        return 'ok'
+
+    @app.route('/fotos')
+    def fotos():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(profiling.bind_to_request(_slow_sophia_call)) for _ in range(4)]
+            for f in futures:
+                f.result()
+        return 'ok'
+
+    client = app.test_client()
+    client.get('/login')
+    return client
+
+
+def test_parallel_sophia_calls_report_wall_clock(client):
+    resp = client.get('/fotos', headers={'X-Profile': '1'})
+
+    assert resp.headers['X-Sophia-Calls'] == '4'
+    timings = dict(part.strip().split(';dur=') for part in ','.join(resp.headers.getlist('Server-Timing')).split(','))
+    # 4 chamadas de 100ms em paralelo: ~100ms de relógio, ~400ms somados
+    assert float(timings['sophia']) < 250
+    assert float(resp.headers['X-Sophia-Ms-Total']) >= 400
+    assert float(timings['sophia']) <= float(timings['app'])
+
+
+def test_profile_includes_worker_threads(client, tmp_path):
+    resp = client.get('/fotos', headers={'X-Profile': '1'})
+
+    path = os.path.join(str(tmp_path), resp.headers['X-Profile-File'])
+    functions = {func for _, _, func in pstats.Stats(path).stats}
+    assert '_slow_sophia_call' in functions
+
+
+def test_profile_files_are_capped(client, tmp_path):
+    for _ in range(5):
+        client.get('/fotos', headers={'X-Profile': '1'})
+        time.sleep(0.01)
+    assert len([f for f in os.listdir(str(tmp_path)) if f.endswith('.prof')]) == 3
+
+
+def test_no_profiling_without_operator_header(client, tmp_path):
+    resp = client.get('/fotos')
+    assert 'X-Sophia-Calls' not in resp.headers
+    assert os.listdir(str(tmp_path)) == []
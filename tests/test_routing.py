@@ -0,0 +1,86 @@
+import re
+
+import pytest
+
+from app.services.routing import RoutingTable, RoutingError, DEFAULT_ROUTING_TABLE
+
+
+def _legacy_collection_name(turma):
+    """Regra fixa que existia em firestore._get_collection_name antes da tabela."""
+    if not turma: return "chamados"
+    turma = turma.strip().upper()
+    if turma.startswith('EI') or turma.startswith('G'):
+        return "chamados_ei"
+    if re.search(r'(?:^|[\s\-])1[\sº°\-]?[A-Z](?![0-9])', turma):
+        return "chamados_1ano"
+    return "chamados_fund"
+
+
+@pytest.mark.parametrize('turma, expected', [
+    ('', 'chamados'),
+    (None, 'chamados'),
+    ('EI-4B-T-2039', 'chamados_ei'),
+    ('ei-4b', 'chamados_ei'),
+    ('G4 A', 'chamados_ei'),
+    ('G1', 'chamados_ei'),
+    ('AI-1A-M', 'chamados_1ano'),
+    ('1B', 'chamados_1ano'),
+    ('1ºA', 'chamados_1ano'),
+    ('1°C', 'chamados_1ano'),
+    ('1-A', 'chamados_1ano'),
+    ('AI 1 A', 'chamados_1ano'),
+    ('  1a  ', 'chamados_1ano'),
+    ('11A', 'chamados_fund'),
+    ('AI-10A', 'chamados_fund'),
+    ('AI-2A', 'chamados_fund'),
+    ('AF-6B-T 2024', 'chamados_fund'),
+    ('   ', 'chamados_fund'),
+])
+def test_default_table_matches_legacy_rules(turma, expected):
+    table = RoutingTable(DEFAULT_ROUTING_TABLE)
+    assert _legacy_collection_name(turma) == expected
+    assert table.resolve(turma) == expected
+
+
+def _two_campus_spec(**shard):
+    return {
+        "campus_padrao": "principal",
+        "campi": [
+            DEFAULT_ROUTING_TABLE["campi"][0],
+            {
+                "nome": "unidade2",
+                "prefixo_rota": "/unidade2",
+                "colecao_padrao": "u2_chamados",
+                "padroes_turma": ["^U2-"],
+                "segmentos": [{"nome": "todos", "colecao": "u2_fund", "rota": "/painel",
+                               "padroes": [".*"], "shards": [shard] if shard else []}],
+            },
+        ],
+    }
+
+
+def test_campus_is_chosen_by_class_pattern_only():
+    table = RoutingTable(_two_campus_spec())
+    assert table.resolve('U2-5A') == 'u2_fund'
+    assert table.resolve('EI-A') == 'chamados_ei'
+    assert table.campus_for('EI-A') is table.default_campus
+
+
+def test_shards_route_and_register_panels():
+    table = RoutingTable(_two_campus_spec(sufixo='manha', padroes=['-M$']))
+    assert table.resolve('U2-5A-M') == 'u2_fund_manha'
+    assert table.resolve('U2-5A-T') == 'u2_fund'
+    assert ('painel_unidade2_todos_manha', '/unidade2/painel-manha', 'u2_fund_manha') in table.panels()
+    assert table.collections_for_segment('todos') == ['u2_fund', 'u2_fund_manha']
+
+
+def test_shard_without_suffix_is_a_routing_error():
+    with pytest.raises(RoutingError):
+        RoutingTable(_two_campus_spec(padroes=['-M$']))
+
+
+def test_resolve_memo_is_bounded():
+    table = RoutingTable(DEFAULT_ROUTING_TABLE)
+    for i in range(RoutingTable.RESOLVE_CACHE_SIZE + 500):
+        table.resolve(f"TURMA-{i}")
+    assert table._resolve_cached.cache_info().currsize == RoutingTable.RESOLVE_CACHE_SIZE
@@ -0,0 +1,116 @@
+import json
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from app.services import sophia
+
+
+def _response(status, text=''):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = text.encode('utf-8')
+    resp.url = 'http://sophia.test'
+    return resp
+
+
+class _FakeDoc:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+@pytest.fixture
+def token_doc(flask_app, monkeypatch):
+    """Documento system_config/sophia_token num Firestore falso."""
+    state = {'data': None}
+    doc_ref = mock.Mock()
+    doc_ref.get.side_effect = lambda: _FakeDoc(state['data'])
+    doc_ref.set.side_effect = lambda data: state.update(data=dict(data))
+    doc_ref.update.side_effect = lambda data: state['data'].update(data)
+    db = mock.Mock()
+    db.collection.return_value.document.return_value = doc_ref
+    monkeypatch.setattr(sophia, 'get_db', lambda: db)
+    return state
+
+
+@pytest.fixture
+def sophia_http(monkeypatch):
+    """Substitui o HTTP (via guard) por uma fila de respostas."""
+    responses = []
+    guard = mock.Mock()
+    guard.call.side_effect = lambda fn, method, url, **kw: responses.pop(0)
+    monkeypatch.setattr(sophia, 'get_guard', lambda: guard)
+    return responses
+
+
+def test_token_about_to_expire_is_not_cached_forever(token_doc, sophia_http, fresh_cache):
+    # Menos de 1s de validade: int(remaining) seria 0 = "nunca expira" no cachelib
+    token_doc['data'] = {'token': 'quase-vencido', 'expires_at': time.time() + 30.5}
+
+    assert sophia.get_sophia_token() == 'quase-vencido'
+    assert sophia._token_cache.get('token') is None
+
+
+def test_token_is_cached_with_remaining_lifetime(token_doc, sophia_http):
+    token_doc['data'] = {'token': 'valido', 'expires_at': time.time() + 600}
+
+    assert sophia.get_sophia_token() == 'valido'
+    assert sophia._token_cache.get('token') == 'valido'
+
+
+def test_401_invalidates_token_and_next_call_reauthenticates(token_doc, sophia_http):
+    token_doc['data'] = {'token': 'recusado', 'expires_at': time.time() + 600}
+    assert sophia.get_sophia_token() == 'recusado'
+
+    sophia_http.append(_response(401))
+    resp = sophia._sophia_request('GET', 'http://sophia.test/api/v1/alunos', headers={'token': 'recusado'})
+    assert resp.status_code == 401
+    assert sophia._token_cache.get('token') is None
+    assert token_doc['data']['expires_at'] == 0
+
+    sophia_http.append(_response(200, 'novo'))
+    assert sophia.get_sophia_token() == 'novo'
+    assert token_doc['data']['token'] == 'novo'
+
+
+def test_401_keeps_token_renewed_by_another_worker(token_doc, sophia_http):
+    token_doc['data'] = {'token': 'renovado', 'expires_at': time.time() + 600}
+
+    sophia_http.append(_response(401))
+    sophia._sophia_request('GET', 'http://sophia.test/api/v1/alunos', headers={'token': 'antigo'})
+
+    assert token_doc['data']['expires_at'] > time.time()
+
+
+def test_photo_failure_is_not_cached_with_search_result(flask_app, monkeypatch):
+    monkeypatch.setattr(sophia, 'get_sophia_token', lambda: 't')
+    flask_app.config['IGNORE_CLASS_PREFIX'] = 'EM'
+    aluno = {'codigo': 123, 'id': 9, 'nome': 'Maria Silva', 'turmas': [{'descricao': 'AI-3A-T 2024'}]}
+    limiter_full = {'value': True}
+    searches = []
+
+    def fake_request(method, url, **kwargs):
+        if url.endswith('/alunos'):
+            searches.append(url)
+            return _response(200, json.dumps([aluno]))
+        if limiter_full['value']:
+            raise sophia.SophiaUnavailable("Limite de concorrência")
+        return _response(200, '{"foto": "base64"}')
+
+    monkeypatch.setattr(sophia, '_sophia_request', fake_request)
+
+    first = sophia.search_students('maria', 'TODOS')
+    assert first[0]['fotoUrl'] is None
+
+    limiter_full['value'] = False
+    second = sophia.search_students('maria', 'TODOS')
+    assert second[0]['fotoUrl'] == 'base64'
+    # Resultado veio do cache de busca; só a foto foi buscada de novo
+    assert len(searches) == 1
+    assert sophia._search_cache.get(('busca', 'MARIA', 'TODOS'))[0]['fotoUrl'] is None
@@ -0,0 +1,89 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, Response
+
+from app.routes import wire
+
+ALUNOS = [{'id': str(i), 'nomeCompleto': f"Aluno Número {i}", 'turma': 'AI-3A', 'fotoUrl': 'x' * 40}
+          for i in range(50)]
+
+
+@pytest.fixture
+def client():
+    app = Flask('teste_wire')
+    app.after_request(wire.compress_response)
+
+    @app.route('/alunos')
+    def alunos():
+        return wire.api_response(ALUNOS)
+
+    @app.route('/pequeno')
+    def pequeno():
+        return wire.api_response({'ok': True})
+
+    @app.route('/stream')
+    def stream():
+        return Response((line for line in ['a,b\n'] * 2000), mimetype='text/csv')
+
+    return app.test_client()
+
+
+def test_fields_projection(client):
+    resp = client.get('/alunos?fields=id,turma')
+    data = json.loads(resp.get_data())
+    assert data[0] == {'id': '0', 'turma': 'AI-3A'}
+    assert len(data) == len(ALUNOS)
+
+
+def test_json_is_compact_and_keeps_accents(client):
+    body = client.get('/pequeno').get_data()
+    assert body == b'{"ok":true}'
+    assert 'Número'.encode('utf-8') in client.get('/alunos').get_data()
+
+
+def test_gzip_above_threshold(client):
+    resp = client.get('/alunos', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    body = gzip.decompress(resp.get_data())
+    assert json.loads(body) == ALUNOS
+    assert resp.headers['X-Uncompressed-Length'] == str(len(body))
+    assert 'Accept-Encoding' in resp.headers['Vary']
+
+
+def test_small_bodies_are_not_compressed(client):
+    resp = client.get('/pequeno', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+
+
+def test_no_compression_without_accept_encoding(client):
+    resp = client.get('/alunos', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in resp.headers
+    assert json.loads(resp.get_data()) == ALUNOS
+
+
+def test_brotli_preferred_when_available(client):
+    brotli = pytest.importorskip('brotli')
+    resp = client.get('/alunos', headers={'Accept-Encoding': 'gzip, br'})
+    assert resp.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(resp.get_data())) == ALUNOS
+
+
+def test_msgpack_negotiation(client):
+    msgpack = pytest.importorskip('msgpack')
+    resp = client.get('/alunos?fields=id', headers={'Accept': 'application/x-msgpack'})
+    assert resp.mimetype == 'application/x-msgpack'
+    assert msgpack.unpackb(resp.get_data(), raw=False)[1] == {'id': '1'}
+    assert 'Accept' in resp.headers['Vary']
+
+
+def test_json_preferred_over_msgpack_by_default(client):
+    resp = client.get('/pequeno', headers={'Accept': '*/*'})
+    assert resp.mimetype == 'application/json'
+
+
+def test_streamed_responses_pass_through(client):
+    resp = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.get_data().startswith(b'a,b\n')